@@ -3,12 +3,9 @@ import pygame
 from settings import *
 
 class Minimap:
-    def __init__(self, mapImg, size, scale, playerColour, playerSize, outlineColour, outlineSize, bgColour):
-        self.minimap = mapImg.copy()
-
-        self.mapSize = mapImg.get_size()
-
-        self.minimap = pygame.transform.scale(self.minimap, (int(self.mapSize[0]*scale), int(self.mapSize[1]*scale)))
+    def __init__(self, minimapImg, size, scale, playerColour, playerSize, outlineColour, outlineSize, bgColour):
+        # The map image is already scaled down by scale
+        self.minimap = minimapImg
 
         self.circleMask = pygame.Surface((size, size))
         pygame.draw.circle(self.circleMask, WHITE, (size/2, size/2), size/2)
@@ -0,0 +1,131 @@
+import os
+import json
+import struct
+import pygame
+import numpy as np
+
+from os import path, makedirs
+from hashlib import sha1
+
+from utilities import packShelves
+from settings import *
+
+# Every image the game uses, characters being named f"{character}_{variation}"
+CHARACTER_NAMES = ["hitman1", "manBlue", "manBrown", "manOld", "soldier1", "survivor1", "womanGreen"]
+CHARACTER_VARIATIONS = ["gun", "hold", "machine", "reload", "silencer", "stand"]
+OBJECT_NAMES = ["flatScreen", "moniter", "oldTV_beige", "oldTV_black", "oldTV_wood", "bullet", "bag"]
+
+IMAGE_DIRECTORY = path.join(path.dirname(__file__), "images")
+
+# An atlas file starts with the length of its manifest, then the manifest, then the atlas pixels as raw RGBA
+MANIFEST_HEADER = struct.Struct("!I")
+
+def returnImageFiles() -> dict:
+    """Return the file of every image by name"""
+    files = {}
+    for character in CHARACTER_NAMES:
+        for variation in CHARACTER_VARIATIONS:
+            files[f"{character}_{variation}"] = path.join(IMAGE_DIRECTORY, "characters", f"{character}_{variation}.png")
+
+    for name in OBJECT_NAMES:
+        files[name] = path.join(IMAGE_DIRECTORY, "objects", f"{name}.png")
+
+    return files
+
+def returnAtlasHash(files, scale) -> str:
+    """Return a hash of the image files' sizes and modification times and the scale, so the atlas is rebuilt when they change"""
+    digest = sha1(repr(scale).encode())
+    for name, filename in files.items():
+        stat = os.stat(filename)
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return digest.hexdigest()
+
+def buildAtlas(files, scale) -> bytes:
+    """Load and scale every image and pack them into the contents of an atlas file"""
+    images = {}
+    for name, filename in files.items():
+        image = pygame.image.load(filename)
+        image = pygame.transform.scale(image, (int(image.get_width()*scale), int(image.get_height()*scale)))
+        images[name] = image
+
+    atlasSize, positions = packShelves({name: image.get_size() for name, image in images.items()})
+
+    # Copy the pixels in directly so they aren't blended with the empty atlas
+    pixels = np.zeros((atlasSize[1], atlasSize[0], 4), dtype=np.uint8)
+    for name, (x, y) in positions.items():
+        width, height = images[name].get_size()
+        pixels[y:y + height, x:x + width] = np.frombuffer(pygame.image.tobytes(images[name], "RGBA"), dtype=np.uint8).reshape(height, width, 4)
+
+    manifest = json.dumps({
+        "size": atlasSize,
+        "images": {name: [x, y, *images[name].get_size()] for name, (x, y) in positions.items()},
+    }).encode()
+
+    return MANIFEST_HEADER.pack(len(manifest)) + manifest + pixels.tobytes()
+
+class ImageGroup:
+    """The variations of one character's images, looked up by variation"""
+    def __init__(self, store, character):
+        self.store = store
+        self.character = character
+
+    def __getitem__(self, variation):
+        return self.store[f"{self.character}_{variation}"]
+
+class AssetStore:
+    """Every image scaled and packed into one atlas cached on the disk, with each image only made into a surface when first used"""
+    def __init__(self, scale):
+        self.scale = scale
+
+        files = returnImageFiles()
+        self.names = list(files)
+
+        # Read the atlas in one go, building it if the images or the scale have changed
+        atlasPath = path.join(CACHE_DIRECTORY, f"atlas_{returnAtlasHash(files, scale)}.bin")
+        try:
+            with open(atlasPath, "rb") as f:
+                data = f.read()
+            self.readAtlas(data)
+        except (OSError, ValueError, KeyError, struct.error):
+            data = buildAtlas(files, scale)
+            self.readAtlas(data)
+
+            # Write to a temporary file first so other processes never read half an atlas
+            makedirs(CACHE_DIRECTORY, exist_ok=True)
+            with open(atlasPath + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(atlasPath + ".tmp", atlasPath)
+
+        # The images that have been used, converted to the display's format
+        self.images = {}
+
+    def readAtlas(self, data) -> None:
+        manifestSize, = MANIFEST_HEADER.unpack_from(data)
+        manifest = json.loads(data[MANIFEST_HEADER.size:MANIFEST_HEADER.size + manifestSize])
+
+        self.rects = {name: pygame.Rect(rect) for name, rect in manifest["images"].items()}
+        if set(self.rects) != set(self.names):
+            raise ValueError("Atlas doesn't match the images")
+
+        # The atlas surface shares the file's memory rather than copying it
+        pixels = memoryview(data)[MANIFEST_HEADER.size + manifestSize:]
+        self.atlas = pygame.image.frombuffer(pixels, tuple(manifest["size"]), "RGBA")
+
+    def __getitem__(self, name) -> pygame.Surface:
+        image = self.images.get(name)
+        if image is None:
+            image = self.atlas.subsurface(self.rects[name]).convert_alpha()
+            self.images[name] = image
+
+        return image
+
+    def __contains__(self, name) -> bool:
+        return name in self.rects
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def returnCharacterImages(self) -> dict:
+        """Return each character's images by character and variation"""
+        return {character: ImageGroup(self, character) for character in CHARACTER_NAMES}
\ No newline at end of file
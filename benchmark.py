@@ -0,0 +1,352 @@
+import os
+import sys
+import gc
+import json
+import random
+import shutil
+import argparse
+import platform
+import tracemalloc
+from time import perf_counter_ns
+from xml.etree import ElementTree
+
+# Benchmarks never draw, so use SDL's dummy drivers
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import numpy as np
+from os import path, makedirs
+
+from game import Game, PlayerSlot
+from client import Client
+from server import Server, AreaOfInterest
+from protocol import SnapshotEncoder, MODE_BINARY
+from sprites import Player
+from utilities import TileMap, MAP_LAYERS
+from playerLighting import returnPlayerSight
+from assets import OBJECT_NAMES
+from settings import *
+
+# The size of the generated maps in tiles, and how many of each thing they are filled with
+SCENARIOS = {
+    "small": {"mapSize": (45, 30), "obsticles": 40, "guards": 4, "bullets": 0, "players": 1, "objects": 10},
+    "medium": {"mapSize": (80, 60), "obsticles": 200, "guards": 50, "bullets": 100, "players": 8, "objects": 100},
+    "large": {"mapSize": (160, 120), "obsticles": 800, "guards": 300, "bullets": 500, "players": 32, "objects": 400},
+}
+
+BENCHMARK_DIRECTORY = path.join(CACHE_DIRECTORY, "benchmark")
+TILESET_FILE = path.join(path.dirname(__file__), "maps", "main tileset.tsx")
+
+# The native size of a map tile, and the scale the game draws them at
+MAP_TILE_SIZE = 128
+MAP_SCALE = 0.5
+
+# A player walking forwards while looking to the right
+WALKING_INPUT = [[[100, 0], (0, 0, 0)], [1, 0], [0, 0], [0, 0], [0, 0], 0, 0, 0, 0]
+
+def returnTileGids() -> tuple:
+    """Return the gid of a floor tile and of a wall tile from the main tileset"""
+    floorGid = wallGid = None
+    for tile in ElementTree.parse(TILESET_FILE).getroot().iter("tile"):
+        isWall = tile.find("properties/property[@name='isWall']").get("value") == "true"
+        if isWall and wallGid is None:
+            wallGid = int(tile.get("id")) + 1
+        elif not isWall and floorGid is None:
+            floorGid = int(tile.get("id")) + 1
+
+    return floorGid, wallGid
+
+def returnLayerXml(layerId, name, data) -> str:
+    rows = ",\n".join(",".join(str(gid) for gid in row) for row in data)
+    return f' <layer id="{layerId}" name="{name}" width="{len(data[0])}" height="{len(data)}">\n  <data encoding="csv">\n{rows}\n</data>\n </layer>\n'
+
+def returnSolidXml(objectId, x, y, width, height, isTransparent) -> str:
+    transparent = "true" if isTransparent else "false"
+    return f'  <object id="{objectId}" name="solid" x="{x}" y="{y}" width="{width}" height="{height}">\n   <properties>\n    <property name="isTransparent" type="bool" value="{transparent}"/>\n   </properties>\n  </object>\n'
+
+def generateStressMap(name, scenario, seed=0) -> tuple:
+    """Write a TMX map filled with a scenario's walls, guards and objects, returning its file and its open tile centers"""
+    rng = random.Random(seed)
+    columns, rows = scenario["mapSize"]
+    floorGid, wallGid = returnTileGids()
+
+    blocked = set()
+    walls = [[0] * columns for _ in range(rows)]
+    objects = []
+
+    def addSolid(left, top, width, height, isTransparent=False):
+        for y in range(top, top + height):
+            for x in range(left, left + width):
+                blocked.add((x, y))
+                walls[y][x] = wallGid
+        objects.append(returnSolidXml(len(objects) + 1, left * MAP_TILE_SIZE, top * MAP_TILE_SIZE, width * MAP_TILE_SIZE, height * MAP_TILE_SIZE, isTransparent))
+
+    # A wall around the edge and blocks of wall scattered inside
+    addSolid(0, 0, columns, 1)
+    addSolid(0, rows - 1, columns, 1)
+    addSolid(0, 1, 1, rows - 2)
+    addSolid(columns - 1, 1, 1, rows - 2)
+    for _ in range(scenario["obsticles"]):
+        width, height = rng.randint(1, 3), rng.randint(1, 3)
+        addSolid(rng.randint(1, columns - 1 - width), rng.randint(1, rows - 1 - height), width, height, rng.random() < 0.1)
+
+    openTiles = [(x, y) for y in range(1, rows - 1) for x in range(1, columns - 1) if (x, y) not in blocked]
+
+    def returnTileCenter(tile):
+        return ((tile[0] + 0.5) * MAP_TILE_SIZE, (tile[1] + 0.5) * MAP_TILE_SIZE)
+
+    # Guards patrol between a few open tiles
+    for _ in range(scenario["guards"]):
+        points = [returnTileCenter(rng.choice(openTiles)) for _ in range(rng.randint(2, 4))]
+        relative = " ".join(f"{x - points[0][0]:g},{y - points[0][1]:g}" for x, y in points)
+        objects.append(f'  <object id="{len(objects) + 1}" name="guard" x="{points[0][0]:g}" y="{points[0][1]:g}">\n   <polygon points="{relative}"/>\n  </object>\n')
+
+    for _ in range(scenario["objects"]):
+        x, y = returnTileCenter(rng.choice(openTiles))
+        image = rng.choice([name for name in OBJECT_NAMES if name not in ("bullet", "bag")])
+        objects.append(f'  <object id="{len(objects) + 1}" name="object" x="{x:g}" y="{y:g}">\n   <properties>\n    <property name="objectImg" value="{image}"/>\n    <property name="objectRotation" type="int" value="{rng.randrange(0, 360, 45)}"/>\n   </properties>\n   <point/>\n  </object>\n')
+
+    x, y = returnTileCenter(rng.choice(openTiles))
+    objects.append(f'  <object id="{len(objects) + 1}" name="player" x="{x:g}" y="{y:g}">\n   <point/>\n  </object>\n')
+
+    tmx = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<map version="1.5" tiledversion="1.7.2" orientation="orthogonal" renderorder="right-down" width="{columns}" height="{rows}" tilewidth="{MAP_TILE_SIZE}" tileheight="{MAP_TILE_SIZE}" infinite="0" nextlayerid="5" nextobjectid="{len(objects) + 1}">\n'
+        f' <tileset firstgid="1" source="{path.relpath(TILESET_FILE, BENCHMARK_DIRECTORY)}"/>\n'
+        + returnLayerXml(1, "Floor", [[floorGid] * columns for _ in range(rows)])
+        + returnLayerXml(2, "Walls", walls)
+        + returnLayerXml(3, "Above", [[0] * columns for _ in range(rows)])
+        + ' <objectgroup id="4" name="Objects">\n' + "".join(objects) + ' </objectgroup>\n'
+        '</map>\n'
+    )
+
+    makedirs(BENCHMARK_DIRECTORY, exist_ok=True)
+    mapFile = path.join(BENCHMARK_DIRECTORY, f"{name}.tmx")
+
+    # Only rewrite the map if it has changed, so the baked chunks of the last run can be reused
+    try:
+        with open(mapFile) as f:
+            unchanged = f.read() == tmx
+    except OSError:
+        unchanged = False
+
+    if not unchanged:
+        with open(mapFile, "w") as f:
+            f.write(tmx)
+
+    scaledTiles = [((x + 0.5) * MAP_TILE_SIZE * MAP_SCALE, (y + 0.5) * MAP_TILE_SIZE * MAP_SCALE) for x, y in openTiles]
+    return mapFile, scaledTiles
+
+def measure(function, iterations, setup=None) -> dict:
+    """Time function over a number of iterations, calling setup untimed before each, and return the percentiles in ms"""
+    gc.collect()
+    blocksBefore = sys.getallocatedblocks()
+
+    durations = []
+    for i in range(iterations):
+        if setup:
+            setup(i)
+
+        start = perf_counter_ns()
+        function(i)
+        durations.append(perf_counter_ns() - start)
+
+    # The memory blocks still held afterwards, which should stay near zero unless something is growing
+    gc.collect()
+    retainedBlocks = (sys.getallocatedblocks() - blocksBefore) / iterations
+
+    # Trace one more run on its own, as tracing slows everything down too much to time
+    if setup:
+        setup(iterations)
+    tracemalloc.start()
+    function(iterations)
+    _, peakBytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations = np.array(durations) / 1e6
+    return {
+        "iterations": iterations,
+        "mean": float(durations.mean()),
+        "p50": float(np.percentile(durations, 50)),
+        "p90": float(np.percentile(durations, 90)),
+        "p99": float(np.percentile(durations, 99)),
+        "max": float(durations.max()),
+        "retainedBlocks": retainedBlocks,
+        "peakBytes": peakBytes,
+    }
+
+def drawWholeMap(tileMap, screen) -> None:
+    """Draw every layer of a map a screen at a time, as a camera panning over all of it would"""
+    for layer in MAP_LAYERS:
+        for y in range(0, int(tileMap.height), screen.get_height()):
+            for x in range(0, int(tileMap.width), screen.get_width()):
+                tileMap.drawLayer(screen, layer, (x, y))
+
+def returnCameraPos(position, mapInfo) -> tuple:
+    """Return where the client's camera is with the player at position"""
+    x = min(max(position[0] - WIDTH / 2, 0), mapInfo.width - WIDTH)
+    y = min(max(position[1] - HEIGHT / 2, 0), mapInfo.height - HEIGHT)
+    return pygame.Vector2(x, y)
+
+def runScenario(name, scenario, iterations, client) -> dict:
+    """Time every benchmarked stage on a scenario's map"""
+    rng = random.Random(1)
+    mapFile, openTiles = generateStressMap(name, scenario)
+    results = {}
+
+    results["tileMapLoad"] = measure(lambda i: TileMap(mapFile, MAP_SCALE), max(iterations // 10, 5))
+
+    # Draw the whole map with nothing baked, with the chunks baked on the disk, then with as many as MAP_CHUNK_BUDGET holds in memory.
+    # The chunks are baked to a directory of their own so clearing it leaves the game's alone
+    screen = pygame.Surface((WIDTH, HEIGHT))
+    bakedDirectory = path.join(BENCHMARK_DIRECTORY, f"{name}_chunks")
+    tileMap = None
+
+    def prepareMap(i, cold):
+        nonlocal tileMap
+        if cold:
+            shutil.rmtree(bakedDirectory, ignore_errors=True)
+
+        tileMap = TileMap(mapFile, MAP_SCALE)
+        tileMap.bakedDirectory = bakedDirectory
+
+    mapIterations = max(iterations // 20, 3)
+    results["mapDrawCold"] = measure(lambda i: drawWholeMap(tileMap, screen), mapIterations, lambda i: prepareMap(i, True))
+    results["mapDrawBaked"] = measure(lambda i: drawWholeMap(tileMap, screen), mapIterations, lambda i: prepareMap(i, False))
+    results["mapDrawWarm"] = measure(lambda i: drawWholeMap(tileMap, screen), iterations)
+
+    game = Game(True, mapFile)
+    game.new()
+    game.deltaT = 1 / SERVER_TICK_RATE
+
+    players = []
+    for _ in range(scenario["players"]):
+        player = Player(game, rng.choice(openTiles), game.characterImgs)
+        player.get_input(WALKING_INPUT)
+        players.append(player)
+
+    guards = [character for character in game.all_characters if character not in players]
+
+    def prepareTick(i):
+        # Keep the number of bullets in flight steady by firing more from the guards
+        inFlight = len(game.projectiles.returnView()[0])
+        for _ in range(scenario["bullets"] - inFlight):
+            shooter = rng.choice(guards or players)
+            game.projectiles.spawn(shooter, shooter.position, rng.uniform(0, 360), 400)
+
+        game.time += game.deltaT * 1000
+
+    # Let everything settle into motion before it is timed
+    for i in range(10):
+        prepareTick(i)
+        game.update()
+
+    results["gameUpdate"] = measure(lambda i: game.update(), iterations, prepareTick)
+
+    # Lights at fresh positions each time, as the client caches them by position
+    lightPositions = [rng.choice(openTiles) for _ in range(iterations + 1)]
+    results["playerSight"] = measure(lambda i: returnPlayerSight(lightPositions[i], game.all_obsticles, client.sightRange, WHITE), iterations)
+
+    # Draw the map chunks the masks need before they are timed, then forget the lights that made
+    client.mapFile = mapFile
+    client.loadMap()
+    for position in lightPositions:
+        client.createScreenMask(position, returnCameraPos(position, client.mapInfo))
+    client.lightingCache.invalidate()
+    results["screenMask"] = measure(lambda i: client.createScreenMask(lightPositions[i], returnCameraPos(lightPositions[i], client.mapInfo)), iterations)
+
+    server = Server.__new__(Server)
+    server.game = game
+
+    # Each player's connection as the server keeps it, having already been sent a keyframe
+    slots = []
+    for player in players:
+        slot = PlayerSlot()
+        slot.player, slot.networkId = player, player.networkId
+        interest = AreaOfInterest(INTEREST_RADIUS, INTEREST_RADIUS + INTEREST_HYSTERESIS)
+        snapshots = SnapshotEncoder()
+        server.encodeSnapshot(game.getSnapshot(), slot, interest, snapshots, None, MODE_BINARY)
+        slots.append((slot, interest, snapshots))
+
+    def prepareSnapshot(i):
+        # Move the game on so each snapshot is a delta against the one before, as clients acknowledge them
+        prepareTick(i)
+        game.update()
+
+    def encodeSnapshot(i):
+        slot, interest, snapshots = slots[i % len(slots)]
+        server.encodeSnapshot(game.getSnapshot(), slot, interest, snapshots, snapshots.sequence, MODE_BINARY)
+
+    results["snapshotEncode"] = measure(encodeSnapshot, iterations, prepareSnapshot)
+
+    return {"parameters": scenario, "timings": results}
+
+def runBenchmarks(scenarioNames, iterations) -> dict:
+    client = Client()
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "lightingBackend": LIGHTING_BACKEND,
+        },
+        "scenarios": {},
+    }
+
+    for name in scenarioNames:
+        print(f"Running {name}", file=sys.stderr)
+        results["scenarios"][name] = runScenario(name, SCENARIOS[name], iterations, client)
+
+    return results
+
+def compareResults(results, baseline, threshold) -> list:
+    """Print how each timing has changed since the baseline and return the ones that got slower by more than threshold"""
+    regressions = []
+    for name, scenario in results["scenarios"].items():
+        baseScenario = baseline["scenarios"].get(name)
+        if not baseScenario:
+            continue
+
+        for stage, timing in scenario["timings"].items():
+            baseTiming = baseScenario["timings"].get(stage)
+            if not baseTiming:
+                continue
+
+            change = timing["p50"] / baseTiming["p50"] - 1 if baseTiming["p50"] else 0
+            regressed = change > threshold
+            if regressed:
+                regressions.append((name, stage, change))
+
+            flag = "REGRESSION" if regressed else ""
+            print(f"{name:8} {stage:12} p50 {baseTiming['p50']:9.3f} -> {timing['p50']:9.3f} ms ({change:+7.1%})  p90 {baseTiming['p90']:9.3f} -> {timing['p90']:9.3f} ms  {flag}")
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the game's hot paths headless on generated stress maps")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="a scenario to run, every one if not given")
+    parser.add_argument("--iterations", type=int, default=100, help="how many times each stage is timed")
+    parser.add_argument("--output", help="save the results as JSON to this file instead of printing them")
+    parser.add_argument("--compare", help="a saved run to compare against, exiting with an error if anything got slower")
+    parser.add_argument("--threshold", type=float, default=0.2, help="how much slower a median can get before it is a regression")
+    arguments = parser.parse_args()
+
+    results = runBenchmarks(arguments.scenario or list(SCENARIOS), arguments.iterations)
+
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(results, f, indent=2)
+    elif not arguments.compare:
+        print(json.dumps(results, indent=2))
+
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compareResults(results, baseline, arguments.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {arguments.threshold:.0%}")
+            sys.exit(1)
\ No newline at end of file
@@ -1,18 +1,18 @@
-from time import time
 import pygame
 
 from os import path
 
-from playerLighting import returnPlayerSight
+from playerLighting import returnPlayerSight, LightingCache
 from utilities import *
 from sprites import *
 from UI import *
-from server import *
 from network import *
+from assets import AssetStore
+from profiler import FrameProfiler
 from settings import *
 
 class Client:
-    def __init__(self):
+    def __init__(self, mapFile=MAP_FILE):
         """Initialise game window, mixer and clock"""
 
         pygame.init()
@@ -23,38 +23,41 @@ class Client:
         self.clock = pygame.time.Clock()
 
         self.scriptDir = path.dirname(__file__)
+        self.mapFile = mapFile
 
         self.scale = 0.5
-        self.spriteImages = self.loadSpriteImages()
+        self.spriteImages = AssetStore(self.scale*2)
 
         self.charaterSize = self.spriteImages["manBlue_stand"].get_size()
 
+        self.rotationCache = RotationCache(self.spriteImages, ROTATION_STEPS, ROTATION_CACHE_BUDGET, ROTATION_CACHE_EAGER, ROTATION_CACHE_ATLAS)
+
         self.mask = pygame.Surface((WIDTH, HEIGHT))
 
         self.sightRange = 400
         self.sightFade = returnFadeSurface(self.sightRange * 2)
+        self.lightingCache = LightingCache(LIGHTING_CACHE_QUANTUM, LIGHTING_CACHE_BUDGET)
         self.wallSightRange = WIDTH
         self.wallFade = pygame.Surface((self.wallSightRange*2, self.wallSightRange*2))
         self.wallFade.blit(returnFadeSurface(self.wallSightRange), (self.wallSightRange/2, self.wallSightRange/2))
 
-        self.lastFramerates = [0 for _ in range(FPS)]
-
-    def new(self):
-        # Create sprite groups
-        self.all_sprites = pygame.sprite.Group()
-        self.all_obsticles = pygame.sprite.Group()
-
-        # Generate the map
-        self.mapInfo = TileMap(path.join(path.join(self.scriptDir, "maps"), "main map.tmx"), self.scale)
+        # A screen sized surface the visible walls are faded on every frame
+        self.fadedWallMask = pygame.Surface((WIDTH, HEIGHT))
+        self.fadedWallMask.set_colorkey(BLACK)
 
-        self.wholeSightMask = pygame.Surface((int(self.mapInfo.width), int(self.mapInfo.height)))
+        # Where the time of every frame goes
+        self.profiler = FrameProfiler()
 
-        self.minimap = Minimap(self.mapInfo.backgroundImg, 200, 0.15, BLUE, 3, ORANGE, 5, (39, 174, 96))
+    def new(self):
+        self.loadMap()
 
-        # Spawn all the obsticles
-        self.loadWalls()
+        self.minimap = Minimap(self.mapInfo.returnScaledLayer("background", 0.15), 200, 0.15, BLUE, 3, ORANGE, 5, (39, 174, 96))
 
-        self.network = Network()
+        # Talk to the server on a background thread so rendering never waits for it
+        if hasattr(self, "network"):
+            self.network.stop()
+        self.network = Network(self.profiler)
+        self.network.start()
 
         self.playerPos = [0, 0]
         self.cameraPos = [0, 0]
@@ -66,15 +69,14 @@ class Client:
         while self.running:
             # Keep loop running at the right speed and get the time since the last frame
             self.deltaT = self.clock.tick(FPS) / 1000
-            
-            self.lastFramerates.append(1/self.deltaT)
-            del self.lastFramerates[0]
-            print(sum(self.lastFramerates)/FPS)
+            self.profiler.lap("idle")
 
             self.events()
             self.update()
             self.draw()
 
+            self.profiler.endFrame(self.deltaT)
+
     def events(self):
         """Handle input"""
 
@@ -83,6 +85,8 @@ class Client:
             if event.type == pygame.QUIT:
                 quit()
 
+            self.profiler.handleEvent(event)
+
         keys = pygame.key.get_pressed()
         mouse = pygame.mouse.get_pos()
         mouseButtons = pygame.mouse.get_pressed()
@@ -102,38 +106,52 @@ class Client:
             keys[pygame.K_b],
         ]
 
+        self.profiler.lap("events")
+
     def update(self):
-        # Send keyboard input to the server
-        self.objectInfo = readInfo(self.network.send(makeInfo(self.importantKeys)))
+        # Queue keyboard input to be sent to the server
+        self.network.setInput(self.importantKeys)
+        # Use the newest snapshot the server has sent
+        self.objectInfo = self.network.getSnapshot()
 
         # Get the character the client is controlling
         self.getPlayerInfo()
+        self.profiler.lap("snapshot")
 
         self.minimap.update(self.playerPos)
+        self.profiler.lap("minimap")
 
     def draw(self):
         self.screen.fill(BLACK)
 
         # Draw the map
-        self.screen.blit(self.mapInfo.backgroundImg, -self.cameraPos)
+        self.mapInfo.drawLayer(self.screen, "background", self.cameraPos)
+        self.profiler.lap("map")
 
         # Draw all sprites if they have an image
         for sprite in self.objectInfo:
             if sprite["image"] != "None":
-                image = self.spriteImages[sprite["image"]]
-                image = pygame.transform.rotate(image, sprite["angle"])
+                image = self.rotationCache.get(sprite["image"], sprite["angle"])
                 self.screen.blit(image, Vector2(sprite["position"])-self.cameraPos)
+        self.profiler.lap("sprites")
 
-        self.screen.blit(self.mapInfo.topImg, -self.cameraPos)
+        self.mapInfo.drawLayer(self.screen, "top", self.cameraPos)
+        self.profiler.lap("map")
 
         # Create and draw the player lighting
         self.createScreenMask(self.playerPos, self.cameraPos)
 
         self.screen.blit(self.mask, pygame.Rect(0, 0, WIDTH, HEIGHT), special_flags=pygame.BLEND_MULT)
+        self.profiler.lap("lighting")
 
         self.minimap.draw(self.screen)
+        self.profiler.lap("minimap")
+
+        self.profiler.draw(self.screen)
+        self.profiler.lap("overlay")
 
         pygame.display.flip()
+        self.profiler.lap("flip")
 
     def getPlayerInfo(self):
         """Get the player's new position and the camera poition"""
@@ -157,52 +175,39 @@ class Client:
         # Clear the mask
         self.mask.fill(BLACK)
 
-        # Create the light mask
-        playerLight = returnPlayerSight(playerPos, self.all_obsticles, self.sightRange, WHITE)
-        # Add the light fade ontop of the light
-        playerLight.blit(self.sightFade, pygame.Rect(0, 0, self.sightRange, self.sightRange), special_flags=pygame.BLEND_MULT)
+        # Reuse the light from the last time the player was here if there is one
+        lightPos = self.lightingCache.quantize(playerPos)
+        playerLight = self.lightingCache.get(lightPos, self.sightRange)
+        if playerLight is None:
+            # Create the light mask
+            playerLight = returnPlayerSight(lightPos, self.all_obsticles, self.sightRange, WHITE)
+            # Add the light fade ontop of the light
+            playerLight.blit(self.sightFade, pygame.Rect(0, 0, self.sightRange, self.sightRange), special_flags=pygame.BLEND_MULT)
+
+            self.lightingCache.add(lightPos, self.sightRange, playerLight)
 
         # Draw the player light onto the screen mask
-        self.mask.blit(playerLight, Vector2(playerPos) - Vector2(cameraPos) - Vector2(self.sightRange, self.sightRange))
+        self.mask.blit(playerLight, lightPos - Vector2(cameraPos) - Vector2(self.sightRange, self.sightRange))
 
-        # Make a copy of the walls mask and draw the walls fade onto it
-        fadedWallMask = self.mapInfo.wallMask.copy()
-        fadedWallMask.blit(self.wallFade, playerPos - Vector2(self.wallSightRange, self.wallSightRange), special_flags=pygame.BLEND_MULT)
+        # Draw the walls on screen into the scratch surface and draw the walls fade onto them
+        self.fadedWallMask.fill(BLACK)
+        self.mapInfo.drawLayer(self.fadedWallMask, "wall", cameraPos)
+        fadePos = Vector2(playerPos) - Vector2(self.wallSightRange, self.wallSightRange)
+        self.fadedWallMask.blit(self.wallFade, (int(fadePos.x) - int(cameraPos[0]), int(fadePos.y) - int(cameraPos[1])), special_flags=pygame.BLEND_MULT)
         # Draw the faded walls mask onto the final mask
-        self.mask.blit(fadedWallMask, -cameraPos)
+        self.mask.blit(self.fadedWallMask, (0, 0))
 
-    def loadSpriteImages(self):
-        """Load all character images"""
-        characters = ["hitman1", "manBlue", "manBrown", "manOld", "soldier1", "survivor1", "womanGreen"]
-        variations = ["gun", "hold", "machine", "reload", "silencer", "stand"]
-
-        objects = ["flatScreen", "moniter", "oldTV_beige", "oldTV_black", "oldTV_wood", "bullet", "bag"]
-
-        imageDirectory = path.join(self.scriptDir, "images")
-
-        characterImages = path.join(imageDirectory, "characters")
-        objectImages = path.join(imageDirectory, "objects")
-
-        allImages = {}
-
-        for character in characters:
-            for variation in variations:
-                filename = f"{character}_{variation}.png"
-
-                image = pygame.image.load(path.join(characterImages, filename)).convert_alpha()
-                image = pygame.transform.scale(image, (int(image.get_width()*self.scale*2), int(image.get_height()*self.scale*2)))
-
-                allImages[f"{character}_{variation}"] = image
-
-        for imgName in objects:
-            filename = f"{imgName}.png"
-
-            image = pygame.image.load(path.join(objectImages, filename)).convert_alpha()
-            image = pygame.transform.scale(image, (int(image.get_width()*self.scale*2), int(image.get_height()*self.scale*2)))
+    def loadMap(self):
+        # Create sprite groups
+        self.all_sprites = pygame.sprite.Group()
+        self.all_obsticles = pygame.sprite.Group()
+        self.obsticleGrid = SpatialHash(GRID_CELL_SIZE)
 
-            allImages[imgName] = image
+        # Generate the map
+        self.mapInfo = TileMap(self.mapFile, self.scale)
 
-        return allImages
+        # Spawn all the obsticles
+        self.loadWalls()
 
     def loadWalls(self):
         for tile_object in self.mapInfo.tmxdata.objects:
@@ -210,8 +215,9 @@ class Client:
                 # Spawn an obsticle
                 Obsticle(self, (tile_object.x*self.scale, tile_object.y*self.scale), (tile_object.width*self.scale, tile_object.height*self.scale), tile_object.properties["isTransparent"])
 
-client = Client()
+if __name__ == "__main__":
+    client = Client()
 
-while True:
-    client.new()
-    client.run()
\ No newline at end of file
+    while True:
+        client.new()
+        client.run()
\ No newline at end of file
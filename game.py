@@ -3,32 +3,112 @@ import pygame
 from sprites import *
 from UI import *
 from utilities import *
-from playerLighting import returnPlayerSight
+from protocol import packEntity, ANGLE_SCALE
+from perception import GuardPerception
+from navigation import NavigationGrid
+from projectiles import ProjectilePool
+from assets import AssetStore
+from telemetry import Telemetry
 from settings import *
 
 from os import path
+from itertools import count
+from collections import deque
+from time import perf_counter, sleep
+
+class WorldSnapshot:
+    """A copy of everything clients are sent, captured once at the end of a tick and never changed after"""
+    def __init__(self, game, tick):
+        self.tick = tick
+
+        # The state of every entity as (focus, image, left, top, angle), characters first so they are drawn under objects
+        self.states = {}
+        # The order of each entity in states
+        self.order = {}
+        # Each entity packed for the binary protocol, so it is only packed once however many clients are sent it
+        self.packed = {}
+        # The center of each entity and a grid of the entities in each cell, for finding what is near a client
+        self.centers = {}
+        self.cells = {}
+
+        for sprite in [*game.all_characters, *game.all_objects]:
+            image = f"{sprite.characterName}_{sprite.imageKey}" if isinstance(sprite, Character) else sprite.imageName
+            self.add(sprite.networkId, image, sprite.rect.left, sprite.rect.top, sprite.angle, sprite.rect.center)
+
+        # Bullets are read straight from the projectile pool's arrays
+        width, height = game.projectiles.imageSize
+        for entityId, left, top, angle in zip(*[array.tolist() for array in game.projectiles.returnView()]):
+            self.add(entityId, "bullet", left, top, angle, (left + width // 2, top + height // 2))
+
+    def add(self, entityId, image, left, top, angle, center) -> None:
+        state = (0, image, left, top, round(angle * ANGLE_SCALE) % 65536)
+        self.states[entityId] = state
+        self.order[entityId] = len(self.order)
+        self.packed[entityId] = packEntity(entityId, *state)
+
+        self.centers[entityId] = center
+        self.cells.setdefault((center[0] // GRID_CELL_SIZE, center[1] // GRID_CELL_SIZE), []).append(entityId)
+
+    def query(self, center, radius) -> list:
+        """Return the ids of the entities in every cell within radius of center"""
+        left = int((center[0] - radius) // GRID_CELL_SIZE)
+        top = int((center[1] - radius) // GRID_CELL_SIZE)
+        right = int((center[0] + radius) // GRID_CELL_SIZE)
+        bottom = int((center[1] + radius) // GRID_CELL_SIZE)
+
+        entityIds = []
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                entityIds.extend(self.cells.get((x, y), ()))
+
+        return entityIds
+
+class PlayerSlot:
+    """A networked player's place in the game. Connections only queue changes to it, the game thread makes them"""
+    def __init__(self):
+        # Set by the game thread once the player has joined
+        self.player = None
+        self.networkId = None
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, mapFile=MAP_FILE):
         """Initialise game window, mixer and clock"""
 
         pygame.init()
-        pygame.mixer.init()
 
-        self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
-        pygame.display.set_caption("server")
-        self.clock = pygame.time.Clock()
+        # A headless game never draws, so it only needs a tiny display for converting images
+        self.headless = headless
+        if headless:
+            self.screen = pygame.display.set_mode((1, 1))
+        else:
+            pygame.mixer.init()
 
-        self.mask = pygame.Surface((WIDTH, HEIGHT))
+            self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
+            pygame.display.set_caption("server")
+        self.clock = pygame.time.Clock()
 
         self.scriptDir = path.dirname(__file__)
+        self.mapFile = mapFile
 
         self.scale = 0.5
 
         self.sightRange = 400
 
-        self.characterImgs = self.loadPlayerImages()
-        self.spriteImgs = self.loadOtherImages()
+        # Every sprite sent to clients gets a unique id from this
+        self.networkIds = count(1)
+
+        # How the game is performing, kept across matches
+        self.telemetry = Telemetry()
+
+        # Players joining, their inputs and players leaving, queued by the connections for the game thread to apply
+        self.commands = deque()
+
+        # Every image, only made into a surface once it is used
+        self.spriteImgs = AssetStore(self.scale*2)
+        self.characterImgs = self.spriteImgs.returnCharacterImages()
+
+        # Rotate the images by the name the sprites use for them
+        self.rotationCache = RotationCache(self.spriteImgs, ROTATION_STEPS, ROTATION_CACHE_BUDGET, ROTATION_CACHE_EAGER, ROTATION_CACHE_ATLAS)
         
     def new(self):
         print("New game created")
@@ -38,38 +118,177 @@ class Game:
 
         self.all_characters = pygame.sprite.Group()
         self.all_objects = pygame.sprite.Group()
-        self.all_projectiles = pygame.sprite.Group()
+
+        # Create the spatial hashes used for collision broadphase
+        self.obsticleGrid = SpatialHash(GRID_CELL_SIZE)
+        self.characterGrid = SpatialHash(GRID_CELL_SIZE)
+        self.objectGrid = SpatialHash(GRID_CELL_SIZE)
+
+        # Every bullet in flight
+        self.projectiles = ProjectilePool(self)
 
         # Generate the map
-        self.mapInfo = TileMap(path.join(path.join(self.scriptDir, "maps"), "main map.tmx"), self.scale)
+        self.mapInfo = TileMap(self.mapFile, self.scale)
 
         # Spawn all the obsticles
         self.loadObjects()
 
+        # Where guards can walk, made once the walls are known
+        self.navigation = NavigationGrid(self.mapInfo)
+
+        # Which player each guard can see, worked out at the start of every tick
+        self.perception = GuardPerception()
+
+        # The simulated time in milliseconds and the time waiting to be simulated in seconds
+        self.time = 0
+        self.accumulator = 0
+
+        # A double buffer of world snapshots, the front one is the latest finished tick
+        self.tick = 0
+        self.worldSnapshots = [None, None]
+        self.frontSnapshot = 0
+        self.captureSnapshot()
+
     def run(self):
         """The game's game loop"""
 
         self.running = True
+
+        if self.headless:
+            self.runFixed()
+            return
+
         while self.running:
             # Keep loop running at the right speed and get the time since the last frame
             self.deltaT = self.clock.tick(FPS) / 1000
             # print(1/self.deltaT)
-            self.events()
-            self.update()
+            self.step()
+
+    def runFixed(self):
+        """Run the game at a fixed timestep of SERVER_TICK_RATE ticks a second"""
+        lastTime = perf_counter()
+        while self.running:
+            now = perf_counter()
+            sleep(self.advance(now - lastTime))
+            lastTime = now
+
+    def advance(self, elapsed) -> float:
+        """Run as many fixed ticks as have built up over elapsed seconds and return the time until the next one"""
+        self.deltaT = 1 / SERVER_TICK_RATE
+        self.accumulator += elapsed
+
+        ticks = 0
+        while self.accumulator >= self.deltaT and self.running:
+            # Stop trying to catch up if the game has fallen too far behind
+            if ticks == MAX_CATCHUP_TICKS:
+                self.telemetry.recordSkippedTicks(int(self.accumulator / self.deltaT))
+                self.accumulator = 0
+                break
+
+            self.step()
+            self.accumulator -= self.deltaT
+            ticks += 1
+
+        return max(0, self.deltaT - self.accumulator)
+
+    def step(self):
+        """Run one tick of the game"""
+        tickStart = perf_counter()
+        self.events()
+        self.update()
+        self.telemetry.recordTick(perf_counter() - tickStart)
+
+        # Keep track of the simulated time so the game doesn't depend on the real clock
+        self.time += self.deltaT * 1000
+
+        if not self.headless:
             self.draw()
 
     def events(self):
         """Process input"""
 
         for event in pygame.event.get():
-            # Check for closing window
-            if event.type == pygame.QUIT:
+            # Check for closing window, a headless game has none and leaves signals to the server
+            if event.type == pygame.QUIT and not self.headless:
                 quit()
 
+    def queueJoin(self) -> PlayerSlot:
+        """Queue a new player to be spawned at the start of the next tick, returning their slot"""
+        slot = PlayerSlot()
+        self.commands.append(("join", slot, None))
+        return slot
+
+    def queueInput(self, slot, keys) -> None:
+        self.commands.append(("input", slot, keys))
+
+    def queueLeave(self, slot) -> None:
+        """Queue a player to be removed from the game at the start of the next tick"""
+        self.commands.append(("leave", slot, None))
+
+    def applyCommands(self) -> None:
+        """Apply everything the connections have queued, on the game thread so sprites are only changed by one thread"""
+        while self.commands:
+            command, slot, keys = self.commands.popleft()
+
+            if command == "join":
+                slot.player = Player(self, self.spawnPoint, self.characterImgs)
+                slot.networkId = slot.player.networkId
+            elif slot.player and slot.player.alive():
+                if command == "input":
+                    slot.player.get_input(keys)
+                else:
+                    slot.player.kill()
+
     def update(self):
         """Update all the sprites"""
+        self.applyCommands()
+        self.perception.update(self.all_characters, self.all_obsticles)
         self.all_sprites.update()
+        self.projectiles.update(self.deltaT, self.obsticleGrid, self.characterGrid)
+
+        self.tick += 1
+        self.captureSnapshot()
+
+    def captureSnapshot(self):
+        """Capture the world into the back snapshot buffer and make it the front one"""
+        back = 1 - self.frontSnapshot
+        self.worldSnapshots[back] = WorldSnapshot(self, self.tick)
+        self.frontSnapshot = back
+
+    def getSnapshot(self) -> WorldSnapshot:
+        """Return the snapshot of the latest finished tick"""
+        return self.worldSnapshots[self.frontSnapshot]
         
+    def returnEntityCounts(self) -> dict:
+        """Return how many entities are in each group"""
+        # The groups only exist once a game has been started
+        if not hasattr(self, "all_sprites"):
+            return {}
+
+        return {
+            "sprites": len(self.all_sprites),
+            "characters": len(self.all_characters),
+            "objects": len(self.all_objects),
+            "obsticles": len(self.all_obsticles),
+            "projectiles": int(self.projectiles.alive.sum()),
+        }
+
+    def getBroadphaseStats(self) -> dict:
+        """Return how many candidate pairs each spatial hash has produced compared to a brute force scan"""
+        # The spatial hashes only exist once a game has been started
+        if not hasattr(self, "obsticleGrid"):
+            return {}
+
+        stats = {}
+        for name, grid in [("obsticles", self.obsticleGrid), ("characters", self.characterGrid), ("objects", self.objectGrid)]:
+            stats[name] = {
+                "queries": grid.queries,
+                "candidatePairs": grid.candidatePairs,
+                "bruteForcePairs": grid.bruteForcePairs,
+            }
+
+        return stats
+
     def loadObjects(self):
         for tile_object in self.mapInfo.tmxdata.objects:
             if tile_object.name == "solid":
@@ -84,57 +303,16 @@ class Game:
             elif tile_object.name == "object":
                 Object(self, (tile_object.x*self.scale, tile_object.y*self.scale), tile_object.properties["objectRotation"], self.spriteImgs[tile_object.properties["objectImg"]], tile_object.properties["objectImg"])
 
-    def loadPlayerImages(self):
-        """Load all character images"""
-        characters = ["hitman1", "manBlue", "manBrown", "manOld", "soldier1", "survivor1", "womanGreen"]
-        variations = ["gun", "hold", "machine", "reload", "silencer", "stand"]
-
-        imageDirectory = path.join(self.scriptDir, "images")
-
-        characterImages = path.join(imageDirectory, "characters")
-
-        allCharacterImgs = {}
-
-        for character in characters:
-            characterImgs = {}
-            for variation in variations:
-                filename = f"{character}_{variation}.png"
-
-                image = pygame.image.load(path.join(characterImages, filename)).convert_alpha()
-                image = pygame.transform.scale(image, (int(image.get_width()*self.scale*2), int(image.get_height()*self.scale*2)))
-
-                characterImgs[variation] = image
-
-            allCharacterImgs[character] = characterImgs
-
-        return allCharacterImgs
-
-    def loadOtherImages(self):
-        objects = ["flatScreen", "moniter", "oldTV_beige", "oldTV_black", "oldTV_wood", "bullet", "bag"]
-
-
-        imageDirectory = path.join(self.scriptDir, "images")
-
-        objectImages = path.join(imageDirectory, "objects")
-
-        allImages = {}
-
-        for imgName in objects:
-            filename = f"{imgName}.png"
-
-            image = pygame.image.load(path.join(objectImages, filename)).convert_alpha()
-            image = pygame.transform.scale(image, (int(image.get_width()*self.scale*2), int(image.get_height()*self.scale*2)))
-
-            allImages[imgName] = image
-
-        return allImages
-
     def draw(self):
         self.screen.fill(BLACK)
-        self.screen.blit(self.mapInfo.backgroundImg, (0, 0))
+        self.mapInfo.drawLayer(self.screen, "background", (0, 0))
 
         for sprite in self.all_sprites:
             if type(sprite) not in [Obsticle]:
                 self.screen.blit(sprite.image, sprite.rect.topleft)
 
+        bulletImg = self.spriteImgs["bullet"]
+        for _, left, top, _ in zip(*self.projectiles.returnView()):
+            self.screen.blit(bulletImg, (int(left), int(top)))
+
         pygame.display.flip()
\ No newline at end of file
@@ -0,0 +1,273 @@
+import os
+import socket
+import asyncio
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from time import perf_counter, monotonic
+
+from server import Server, Game
+from telemetry import MetricsServer
+from settings import *
+
+class Match(Server):
+    """A worker process that plays one match at a time with the connections the lobby hands it"""
+    def __init__(self, workerIndex, pipe):
+        self.workerIndex = workerIndex
+        self.pipe = pipe
+
+        self.players = []
+
+        # How many matches this worker has started, and the connections it has been handed in total and right now
+        self.matchCount = 0
+        self.joined = 0
+        self.connections = 0
+
+        # The time spent ticking, the tick count and the time at the last health report
+        self.busyTime = 0
+        self.lastReportTick = 0
+        self.lastReportTime = perf_counter()
+        self.matchStartTime = 0
+
+        # Tasks are only weakly referenced by the event loop, so keep every connection's
+        self.connectionTasks = set()
+
+        self.game = Game(True)
+
+        # Each worker serves its match's metrics on its own port after TELEMETRY_PORT
+        if TELEMETRY_PORT is not None:
+            self.metricsServer = MetricsServer(self.game, port=TELEMETRY_PORT + 1 + workerIndex)
+
+        self.handleSignals()
+
+        asyncio.run(self.serveMatch())
+
+    async def serveMatch(self):
+        """Receive connections from the lobby, starting a new match when the first one arrives"""
+        loop = asyncio.get_running_loop()
+
+        self.playing = asyncio.Event()
+        self.gameTask = asyncio.create_task(self.runGameAsync())
+        self.reportTask = asyncio.create_task(self.reportHealth())
+
+        while True:
+            try:
+                connection = await loop.run_in_executor(None, self.pipe.recv)
+            except EOFError:
+                # The lobby has closed
+                return
+
+            if not self.playing.is_set():
+                self.startMatch()
+
+            self.joined += 1
+            self.connections += 1
+            task = asyncio.create_task(self.playConnection(connection))
+            self.connectionTasks.add(task)
+            task.add_done_callback(self.connectionTasks.discard)
+
+    def onSignal(self, signum, frame):
+        self.stop()
+
+        # The event loop would wait forever on the executor thread reading the pipe, so leave without unwinding it
+        os._exit(0)
+
+    def startMatch(self):
+        self.game.new()
+        self.matchCount += 1
+        self.lastReportTick = 0
+        self.lastReportTime = self.matchStartTime = perf_counter()
+        self.playing.set()
+
+    def endMatch(self):
+        self.playing.clear()
+        self.sendHealth(True)
+
+    async def playConnection(self, connection):
+        reader, writer = await asyncio.open_connection(sock=connection)
+        await self.handleClient(reader, writer)
+
+        # The match ends when its last connection closes, freeing the worker for a new one
+        self.connections -= 1
+        if not self.connections:
+            self.endMatch()
+
+    async def runGameAsync(self):
+        """Tick the game at a fixed timestep while a match is being played"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self.playing.wait()
+            self.game.running = True
+
+            lastTickTime = loop.time()
+            while self.playing.is_set():
+                tickTime = loop.time()
+
+                tickStart = perf_counter()
+                delay = self.game.advance(tickTime - lastTickTime)
+                self.busyTime += perf_counter() - tickStart
+
+                await asyncio.sleep(delay)
+                lastTickTime = tickTime
+
+    async def reportHealth(self):
+        while True:
+            await asyncio.sleep(MATCH_HEALTH_INTERVAL)
+            self.sendHealth(False)
+
+    def sendHealth(self, ended):
+        """Send the lobby how the match is doing"""
+        now = perf_counter()
+        interval = now - self.lastReportTime
+        self.lastReportTime = now
+
+        ticks = 0
+        if self.playing.is_set():
+            ticks = self.game.tick - self.lastReportTick
+            self.lastReportTick = self.game.tick
+
+        self.pipe.send({
+            "match": self.matchCount,
+            "playing": self.playing.is_set(),
+            "warmingUp": now - self.matchStartTime < MATCH_HEALTH_GRACE,
+            "ended": ended,
+            "players": len(self.players),
+            "joined": self.joined,
+            "tickRate": ticks / interval,
+            "load": self.busyTime / interval,
+        })
+        self.busyTime = 0
+
+def runMatches(workerIndex, pipe):
+    """The entry point of a worker process"""
+    # Matches never draw, so use SDL's dummy drivers whatever the lobby was started with
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+    Match(workerIndex, pipe)
+
+class MatchWorker:
+    """The lobby's view of one worker process and the match it is playing"""
+    def __init__(self, context, index):
+        self.index = index
+
+        self.pipe, workerPipe = context.Pipe()
+        self.process = context.Process(target=runMatches, args=(index, workerPipe), daemon=True)
+        self.process.start()
+        workerPipe.close()
+
+        # How many connections have been handed to the worker, and the last health report it sent
+        self.handedOver = 0
+        self.health = {"match": 0, "playing": False, "warmingUp": False, "ended": False, "players": 0, "joined": 0, "tickRate": 0, "load": 0}
+        self.lastReportTime = None
+
+    def returnPlayerCount(self) -> int:
+        """Return the players in the match, counting ones handed over since the last report"""
+        return self.health["players"] + self.handedOver - self.health["joined"]
+
+    def isHealthy(self) -> bool:
+        """Return whether the worker can be sent new players, the players already in its match are never moved"""
+        if not self.process.is_alive():
+            return False
+
+        # A worker that has stopped reporting is stuck
+        if self.lastReportTime and monotonic() - self.lastReportTime > MATCH_HEALTH_INTERVAL * 5:
+            return False
+
+        # A match that has just started is still loading and catching up, so its first reports don't count against it
+        if not self.health["playing"] or self.health["warmingUp"]:
+            return True
+
+        return self.health["tickRate"] >= MATCH_MIN_TICK_RATE
+
+    def handOver(self, connection):
+        self.pipe.send(connection)
+        self.handedOver += 1
+
+class Lobby:
+    """Accepts connections and sends each one to a match running in a pool of worker processes"""
+    def __init__(self, workers=MATCH_WORKERS, playersPerMatch=MATCH_PLAYERS):
+        self.host = "127.0.0.1"
+        self.port = 1024
+
+        self.playersPerMatch = playersPerMatch
+
+        # Each match runs in its own process so they don't share the GIL, with one per core by default
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [MatchWorker(self.context, index) for index in range(workers or os.cpu_count())]
+        self.lock = threading.Lock()
+
+        print(f"Hosting up to {len(self.workers)} matches of {playersPerMatch} players")
+
+        threading.Thread(target=self.watchWorkers, daemon=True).start()
+
+        self.startAccepting()
+
+    def startAccepting(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind((self.host, self.port))
+            s.listen()
+
+            print("Waiting for connections")
+            while True:
+                conn, addr = s.accept()
+
+                with self.lock:
+                    worker = self.chooseWorker()
+                    if worker:
+                        print(f"Sending {addr[0]}:{addr[1]} to worker {worker.index}")
+                        worker.handOver(conn)
+                    else:
+                        print(f"Turned away {addr[0]}:{addr[1]}, every match is full")
+
+                # The worker has its own copy of the socket
+                conn.close()
+
+    def chooseWorker(self):
+        """Return the worker to send a new player to, or None if there is no room"""
+        available = [worker for worker in self.workers if worker.isHealthy() and worker.returnPlayerCount() < self.playersPerMatch]
+
+        # Fill matches that are already being played first, leaving the rest of the workers free for new matches
+        playing = [worker for worker in available if worker.returnPlayerCount()]
+        if playing:
+            return max(playing, key=lambda worker: worker.returnPlayerCount())
+
+        return available[0] if available else None
+
+    def watchWorkers(self):
+        """Read the health reports of every worker and replace any that die"""
+        while True:
+            ready = wait([worker.pipe for worker in self.workers], MATCH_HEALTH_INTERVAL)
+
+            with self.lock:
+                for worker in self.workers:
+                    if worker.pipe in ready:
+                        try:
+                            self.updateHealth(worker, worker.pipe.recv())
+                        except (EOFError, OSError):
+                            pass
+
+                    if not worker.process.is_alive():
+                        print(f"Worker {worker.index} died, its players have been disconnected")
+                        worker.pipe.close()
+                        self.workers[worker.index] = MatchWorker(self.context, worker.index)
+
+    def updateHealth(self, worker, health):
+        wasHealthy = worker.isHealthy()
+
+        worker.health = health
+        worker.lastReportTime = monotonic()
+
+        if health["ended"]:
+            print(f"Match {health['match']} on worker {worker.index} ended, the worker is free for a new match")
+        elif wasHealthy and not worker.isHealthy():
+            print(f"Match {health['match']} on worker {worker.index} is running at {health['tickRate']:.0f} ticks a second, not sending it new players")
+
+    def returnHealth(self) -> list:
+        """Return the last health report of every worker"""
+        with self.lock:
+            return [dict(worker.health, worker=worker.index, alive=worker.process.is_alive()) for worker in self.workers]
+
+if __name__ == "__main__":
+    lobby = Lobby()
\ No newline at end of file
@@ -0,0 +1,228 @@
+import pytmx
+import numpy as np
+
+from heapq import heappush, heappop
+from collections import OrderedDict
+from math import sqrt
+
+from settings import *
+
+# The eight directions a path can step in and what each step costs
+NEIGHBOUR_STEPS = [(1, 0, 1), (-1, 0, 1), (0, 1, 1), (0, -1, 1), (1, 1, sqrt(2)), (1, -1, sqrt(2)), (-1, 1, sqrt(2)), (-1, -1, sqrt(2))]
+
+class FlowField:
+    """The next cell to step to from every cell within maxCost steps of one target cell"""
+    def __init__(self, navigation, target, maxCost=FLOW_FIELD_RANGE):
+        self.target = target
+
+        self.nextCells = {target: target}
+
+        # Search outwards from the target, each cell pointing back at the one it was reached from
+        distances = {target: 0}
+        queue = [(0, target)]
+        while queue:
+            distance, cell = heappop(queue)
+            if distance > distances[cell]:
+                continue
+
+            for neighbour, cost in navigation.returnNeighbours(cell):
+                # Guards further away than this can't see the player, so don't spend time on them
+                if distance + cost > maxCost:
+                    continue
+
+                if distance + cost < distances.get(neighbour, float("inf")):
+                    distances[neighbour] = distance + cost
+                    self.nextCells[neighbour] = cell
+                    heappush(queue, (distance + cost, neighbour))
+
+    def returnNextCell(self, cell):
+        """Return the cell to step to next from cell, or None if the target can't be reached from it"""
+        return self.nextCells.get(cell)
+
+class NavigationGrid:
+    """A grid of the walkable tiles of a map for guards to find their way around walls"""
+    def __init__(self, tileMap):
+        self.cellWidth = tileMap.tileWidth
+        self.cellHeight = tileMap.tileHeight
+
+        self.columns = tileMap.tmxdata.width
+        self.rows = tileMap.tmxdata.height
+
+        # A cell is blocked if it has a wall tile on any layer or a solid map object over any of it. Other obsticles,
+        # like the colliders of objects that can be picked up, are small enough for guards to steer around
+        self.blocked = np.zeros((self.rows, self.columns), dtype=bool)
+
+        tile_prop = tileMap.tmxdata.get_tile_properties_by_gid
+        for layer in tileMap.tmxdata.visible_layers:
+            if isinstance(layer, pytmx.TiledTileLayer):
+                for y, row in enumerate(layer.data):
+                    for x, gid in enumerate(row):
+                        properties = tile_prop(gid) if gid else None
+                        if properties and properties.get("isWall"):
+                            self.blocked[y, x] = True
+
+        for tile_object in tileMap.tmxdata.objects:
+            if tile_object.name == "solid":
+                x, y = tile_object.x * tileMap.scale, tile_object.y * tileMap.scale
+                left, top = self.returnCell((x, y))
+                right, bottom = self.returnCell((x + tile_object.width * tileMap.scale - 1, y + tile_object.height * tileMap.scale - 1))
+                self.blocked[max(top, 0):bottom + 1, max(left, 0):right + 1] = True
+
+        # The walkable neighbours of every cell, worked out once as the walls never move
+        self.walkable = (~self.blocked).tolist()
+        self.neighbours = {(x, y): self.findNeighbours((x, y)) for y in range(self.rows) for x in range(self.columns)}
+
+        # Which connected area each walkable cell is in, so paths between areas are known not to exist without searching
+        self.regions = self.findRegions()
+
+        # Paths are cached by their start and goal cell as the path and where along it the start is,
+        # using at most PATH_CACHE_SIZE entries
+        self.paths = OrderedDict()
+
+        # The flow field towards each player and the cell they were in when it was made
+        self.flowFields = {}
+
+        self.pathHits = 0
+        self.pathMisses = 0
+        self.flowFieldBuilds = 0
+
+    def returnCell(self, position) -> tuple:
+        return (int(position[0] // self.cellWidth), int(position[1] // self.cellHeight))
+
+    def returnCellCenter(self, cell) -> tuple:
+        return ((cell[0] + 0.5) * self.cellWidth, (cell[1] + 0.5) * self.cellHeight)
+
+    def isWalkable(self, cell) -> bool:
+        x, y = cell
+        return 0 <= x < self.columns and 0 <= y < self.rows and self.walkable[y][x]
+
+    def returnNeighbours(self, cell) -> list:
+        """Return the walkable cells next to a cell and the cost of stepping to each"""
+        return self.neighbours.get(cell, ())
+
+    def findNeighbours(self, cell) -> list:
+        x, y = cell
+
+        neighbours = []
+        for stepX, stepY, cost in NEIGHBOUR_STEPS:
+            neighbour = (x + stepX, y + stepY)
+            if not self.isWalkable(neighbour):
+                continue
+
+            # Don't cut the corners of walls when moving diagonally
+            if stepX and stepY and not (self.isWalkable((x + stepX, y)) and self.isWalkable((x, y + stepY))):
+                continue
+
+            neighbours.append((neighbour, cost))
+
+        return neighbours
+
+    def findRegions(self) -> dict:
+        """Label every walkable cell with the connected area it is in"""
+        regions = {}
+        region = 0
+        for cell in self.neighbours:
+            if cell in regions or not self.isWalkable(cell):
+                continue
+
+            # Flood out from the first unlabeled cell
+            region += 1
+            regions[cell] = region
+            stack = [cell]
+            while stack:
+                for neighbour, _ in self.returnNeighbours(stack.pop()):
+                    if neighbour not in regions:
+                        regions[neighbour] = region
+                        stack.append(neighbour)
+
+        return regions
+
+    def findPath(self, start, goal) -> tuple:
+        """Return a path of cells to the goal cell, shared with the other cells along it, and the start cell's index in it, or (None, 0) if there is no path"""
+        key = (start, goal)
+        if key in self.paths:
+            self.pathHits += 1
+            self.paths.move_to_end(key)
+            return self.paths[key]
+
+        self.pathMisses += 1
+        path = self.searchPath(start, goal)
+
+        # Every later cell on a shortest path has the rest of it as its own shortest path to the goal,
+        # so cache those too for when the guard gets there, sharing the one path rather than copying it
+        if path:
+            for i in range(len(path) - 1, 0, -1):
+                self.paths[(path[i], goal)] = (path, i)
+        self.paths[key] = (path, 0)
+
+        while len(self.paths) > PATH_CACHE_SIZE:
+            self.paths.popitem(last=False)
+
+        return path, 0
+
+    def searchPath(self, start, goal) -> None or list:
+        """Find the shortest path between two cells with A*"""
+        # Searching for a cell that can't be reached would visit every cell that can first
+        if not self.isWalkable(goal) or (start in self.regions and self.regions[start] != self.regions[goal]):
+            return None
+
+        def heuristic(cell):
+            # The octile distance, the shortest path if there were no walls
+            dx, dy = abs(cell[0] - goal[0]), abs(cell[1] - goal[1])
+            return max(dx, dy) + (sqrt(2) - 1) * min(dx, dy)
+
+        previous = {start: None}
+        costs = {start: 0}
+        queue = [(heuristic(start), start)]
+        while queue:
+            _, cell = heappop(queue)
+
+            if cell == goal:
+                path = []
+                while cell:
+                    path.append(cell)
+                    cell = previous[cell]
+                return path[::-1]
+
+            for neighbour, cost in self.returnNeighbours(cell):
+                cost += costs[cell]
+                if cost < costs.get(neighbour, float("inf")):
+                    costs[neighbour] = cost
+                    previous[neighbour] = cell
+                    heappush(queue, (cost + heuristic(neighbour), neighbour))
+
+        return None
+
+    def returnFlowField(self, player) -> FlowField:
+        """Return the flow field towards a player, only rebuilding it when they move to another cell"""
+        cell = self.returnCell(player.position)
+
+        flowField = self.flowFields.get(player)
+        if not flowField or flowField.target != cell:
+            # Forget the fields of players that have left the game
+            for oldPlayer in [oldPlayer for oldPlayer in self.flowFields if not oldPlayer.alive()]:
+                del self.flowFields[oldPlayer]
+
+            flowField = FlowField(self, cell)
+            self.flowFields[player] = flowField
+            self.flowFieldBuilds += 1
+
+        return flowField
+
+    def returnPathWaypoint(self, position, goal) -> tuple:
+        """Return where to head next to walk from position to goal"""
+        path, index = self.findPath(self.returnCell(position), self.returnCell(goal))
+
+        if not path or index + 1 >= len(path):
+            return tuple(goal)
+
+        return self.returnCellCenter(path[index + 1])
+
+    def returnFlowWaypoint(self, position, player) -> tuple:
+        """Return where to head next to walk from position to a player"""
+        nextCell = self.returnFlowField(player).returnNextCell(self.returnCell(position))
+
+        if not nextCell or nextCell == self.returnCell(position) or nextCell == self.returnCell(player.position):
+            return tuple(player.position)
+
+        return self.returnCellCenter(nextCell)
\ No newline at end of file
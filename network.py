@@ -1,26 +1,111 @@
 import socket
+import threading
+
+from time import perf_counter, sleep
+
+from protocol import Connection, SnapshotDecoder, PROTOCOL_MODES
+from settings import *
 
 class Network():
     """A class that connects a client to the server"""
-    def __init__(self):
+    def __init__(self, profiler=None):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server = "127.0.0.1"
         self.port = 1024
         self.address = (self.server, self.port)
+        self.connection = Connection(self.client)
         self.info = self.connect()
 
+        # The client's copy of every entity, kept up to date by the snapshots from the server
+        self.snapshots = SnapshotDecoder()
+        self.snapshots.apply(self.info)
+
+        # The newest input to send, replaced by the render loop whenever it likes
+        self.latestInput = None
+
+        # A double buffer of entity lists. The network thread fills the back one and then flips which is the front,
+        # so the render loop can always read the front one without waiting
+        self.buffers = [self.snapshots.returnInfoList(), []]
+        self.front = 0
+
+        self.running = False
+        self.thread = None
+
+        # Where the round trip and decoding times are recorded, if anywhere
+        self.profiler = profiler
+
     def connect(self):
         try:
-            # Connect to the client and get the position of the player
+            # Connect to the server, agree on a protocol and get the first snapshot
             self.client.connect(self.address)
-            return self.client.recv(2048).decode()
+            self.connection.requestHandshake(PROTOCOL_MODES[NETWORK_PROTOCOL])
+            return self.connection.recvSnapshot()
         except Exception:
             pass
 
-    def send(self, data):
-        """Send messages to the server"""
+    def send(self, keys, ack):
+        """Send key presses to the server and return the snapshot it replies with"""
         try:
-            self.client.send((data).encode())
-            return self.client.recv(2048).decode()
+            self.connection.sendInput(keys, ack)
+            return self.connection.recvSnapshot()
         except socket.error as e:
-            print(e)
\ No newline at end of file
+            # The socket is shut on purpose when stopping
+            if self.running:
+                print(e)
+
+    def start(self) -> None:
+        """Start sending inputs and receiving snapshots on a background thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+
+        # Shut the socket before waiting for the thread, as it may be blocked waiting for a snapshot that will never come
+        try:
+            self.client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # It never connected or the server has already gone
+            pass
+        self.client.close()
+
+        if self.thread:
+            self.thread.join(NETWORK_STOP_TIMEOUT)
+
+    def setInput(self, keys) -> None:
+        """Set the input that will be sent next"""
+        self.latestInput = keys
+
+    def getSnapshot(self) -> list:
+        """Return the newest entity list received, without waiting for the network"""
+        return self.buffers[self.front]
+
+    def run(self) -> None:
+        """Send the latest input NETWORK_SEND_RATE times a second and publish every snapshot that comes back"""
+        sendPeriod = 1 / NETWORK_SEND_RATE
+        nextSendTime = perf_counter()
+
+        while self.running:
+            if self.latestInput is not None:
+                sendTime = perf_counter()
+                snapshot = self.send(self.latestInput, self.snapshots.sequence)
+                if snapshot is None:
+                    self.running = False
+                    break
+                receiveTime = perf_counter()
+
+                self.snapshots.apply(snapshot)
+
+                # Fill the back buffer and then make it the front
+                back = 1 - self.front
+                self.buffers[back] = self.snapshots.returnInfoList()
+                self.front = back
+
+                if self.profiler:
+                    self.profiler.record("networkWait", receiveTime - sendTime)
+                    self.profiler.record("decode", perf_counter() - receiveTime)
+
+            # Wait for the next send, unless the round trip has put us behind
+            nextSendTime = max(nextSendTime + sendPeriod, perf_counter())
+            sleep(max(0, nextSendTime - perf_counter()))
\ No newline at end of file
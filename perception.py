@@ -0,0 +1,119 @@
+import numpy as np
+
+import playerLighting
+from sprites import Guard, Player
+
+# How many guard to player sight lines are tested against the obsticles at once, to bound the memory used
+RAYCAST_BATCH_SIZE = 256
+
+class RectArrays:
+    """The bounds of a list of rects stored in contiguous arrays, grown on every side by padding"""
+    def __init__(self, rects, padding=(0, 0)):
+        self.lefts = np.array([rect.left - padding[0] for rect in rects], dtype=np.float64)
+        self.tops = np.array([rect.top - padding[1] for rect in rects], dtype=np.float64)
+        self.rights = np.array([rect.right + padding[0] for rect in rects], dtype=np.float64)
+        self.bottoms = np.array([rect.bottom + padding[1] for rect in rects], dtype=np.float64)
+
+def returnSlabs(starts, directions, lows, highs) -> tuple:
+    """Return when each ray enters and leaves the space between lows and highs along one axis, broadcasting the rays against the bounds"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lowTimes = (lows - starts) / directions
+        highTimes = (highs - starts) / directions
+
+    enter = np.minimum(lowTimes, highTimes)
+    leave = np.maximum(lowTimes, highTimes)
+
+    # Rays parallel to the axis are either always or never between the two
+    parallel = directions == 0
+    between = (starts > lows) & (starts < highs)
+    enter = np.where(parallel, np.where(between, -np.inf, np.inf), enter)
+    leave = np.where(parallel, np.where(between, np.inf, -np.inf), leave)
+
+    return enter, leave
+
+def returnHitTimes(starts, directions, rects, paired=False) -> np.ndarray:
+    """Return how far along each segment from starts by directions it first touches each rect, or inf if it doesn't.
+    If paired, each segment is only tested against the rect at the same index rather than against every rect"""
+    if paired:
+        enterX, leaveX = returnSlabs(starts[:, 0], directions[:, 0], rects.lefts, rects.rights)
+        enterY, leaveY = returnSlabs(starts[:, 1], directions[:, 1], rects.tops, rects.bottoms)
+    else:
+        enterX, leaveX = returnSlabs(starts[:, 0, None], directions[:, 0, None], rects.lefts[None, :], rects.rights[None, :])
+        enterY, leaveY = returnSlabs(starts[:, 1, None], directions[:, 1, None], rects.tops[None, :], rects.bottoms[None, :])
+
+    # The segment hits a rect if it is inside both slabs at once somewhere along its length
+    enter = np.maximum(np.maximum(enterX, enterY), 0)
+    leave = np.minimum(np.minimum(leaveX, leaveY), 1)
+
+    return np.where(enter < leave, enter, np.inf)
+
+def returnBlockedSightLines(starts, ends, rects) -> np.ndarray:
+    """Return which of the segments from starts to ends pass through an obsticle"""
+    blocked = np.zeros(len(starts), dtype=bool)
+    if not len(rects.lefts):
+        return blocked
+
+    for first in range(0, len(starts), RAYCAST_BATCH_SIZE):
+        batchStarts = starts[first:first + RAYCAST_BATCH_SIZE]
+        directions = ends[first:first + RAYCAST_BATCH_SIZE] - batchStarts
+
+        blocked[first:first + RAYCAST_BATCH_SIZE] = np.isfinite(returnHitTimes(batchStarts, directions, rects)).any(axis=1)
+
+    return blocked
+
+class GuardPerception:
+    """Works out which player every guard can see once a tick, so guards only have to look up their target"""
+    def __init__(self):
+        # The player each guard is targeting
+        self.targets = {}
+
+        self.rects = None
+        self.obsticleVersion = None
+
+        # How many guard and player pairs were in range and needed a sight line testing, for measuring
+        self.pairs = 0
+        self.raycasts = 0
+
+    def returnObsticleRects(self, obsticles) -> RectArrays:
+        # Rebuild the obsticle arrays if the obsticles have changed since they were made
+        if self.obsticleVersion != playerLighting.obsticleVersion:
+            self.rects = RectArrays([obsticle.rect for obsticle in obsticles if not obsticle.isTransparent])
+            self.obsticleVersion = playerLighting.obsticleVersion
+
+        return self.rects
+
+    def update(self, characters, obsticles) -> None:
+        """Find the closest player in sight of every guard"""
+        guards = [character for character in characters if isinstance(character, Guard)]
+        players = [character for character in characters if isinstance(character, Player)]
+
+        self.targets = {}
+        if not guards or not players:
+            return
+
+        guardPositions = np.array([(guard.position.x, guard.position.y) for guard in guards], dtype=np.float64)
+        playerPositions = np.array([(player.position.x, player.position.y) for player in players], dtype=np.float64)
+        sightRanges = np.array([guard.sightRange for guard in guards], dtype=np.float64)
+
+        # The distance from every guard to every player
+        offsets = guardPositions[:, None, :] - playerPositions[None, :, :]
+        distances = np.einsum("gpi,gpi->gp", offsets, offsets)
+
+        # Only cast sight lines for the players in range of each guard
+        guardIndexes, playerIndexes = np.nonzero(distances <= (sightRanges ** 2)[:, None])
+        self.pairs = len(guards) * len(players)
+        self.raycasts = len(guardIndexes)
+
+        blocked = returnBlockedSightLines(guardPositions[guardIndexes], playerPositions[playerIndexes], self.returnObsticleRects(obsticles))
+
+        # Keep the closest player each guard can see
+        visible = np.full(distances.shape, np.inf)
+        visible[guardIndexes[~blocked], playerIndexes[~blocked]] = distances[guardIndexes[~blocked], playerIndexes[~blocked]]
+
+        closest = visible.argmin(axis=1)
+        for guardIndex in np.nonzero(np.isfinite(visible[np.arange(len(guards)), closest]))[0]:
+            self.targets[guards[guardIndex]] = players[closest[guardIndex]]
+
+    def returnTargetPlayer(self, guard) -> None or Player:
+        """Return the closest player the guard can see, or None"""
+        return self.targets.get(guard)
\ No newline at end of file
@@ -1,10 +1,268 @@
 import pygame
+import numpy as np
 
-from math import sin, cos, pi
+from collections import OrderedDict
+from math import sin, cos, atan2, pi
 
 from settings import *
 
+# Bumped whenever an obsticle is created or killed so cached obsticle data can be rebuilt
+obsticleVersion = 0
+
+def obsticlesChanged():
+    """Called whenever the obsticles change shape"""
+    global obsticleVersion
+    obsticleVersion += 1
+
+class LightingCache:
+    """A least recently used cache of light surfaces keyed by quantized light position and sight range"""
+    def __init__(self, quantum, memoryBudget):
+        self.quantum = quantum
+        self.memoryBudget = memoryBudget
+
+        self.surfaces = OrderedDict()
+        self.memoryUsed = 0
+
+        self.obsticleVersion = obsticleVersion
+
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, lightPos) -> pygame.Vector2:
+        """Snap a light position to the cache grid"""
+        return pygame.Vector2(round(lightPos[0] / self.quantum) * self.quantum, round(lightPos[1] / self.quantum) * self.quantum)
+
+    def get(self, lightPos, sightRange):
+        """Return the cached light for a quantized position, or None"""
+        # Throw everything away if the obsticles have changed since the lights were drawn
+        if self.obsticleVersion != obsticleVersion:
+            self.invalidate()
+
+        key = (lightPos[0], lightPos[1], sightRange)
+        light = self.surfaces.get(key)
+        if light is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.surfaces.move_to_end(key)
+        return light
+
+    def add(self, lightPos, sightRange, light) -> None:
+        key = (lightPos[0], lightPos[1], sightRange)
+        if key in self.surfaces:
+            return
+
+        self.surfaces[key] = light
+        self.memoryUsed += light.get_pitch() * light.get_height()
+
+        # Evict the least recently used lights until the cache fits in its budget
+        while self.memoryUsed > self.memoryBudget and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.memoryUsed -= evicted.get_pitch() * evicted.get_height()
+
+    def invalidate(self) -> None:
+        self.surfaces.clear()
+        self.memoryUsed = 0
+        self.obsticleVersion = obsticleVersion
+
 def returnPlayerSight(playerPos, obsticles, sightRange, colour):
+    """Return a surface of size 2*sightRange lit in colour where the player can see"""
+    if LIGHTING_BACKEND == "shaddows":
+        return returnShaddowSight(playerPos, obsticles, sightRange, colour)
+    elif LIGHTING_BACKEND == "numpy":
+        return returnNumpySight(playerPos, obsticles, sightRange, colour)
+
+    return returnSweepSight(playerPos, obsticles, sightRange, colour)
+
+def returnSweepSight(playerPos, obsticles, sightRange, colour):
+    """Light the area visible from playerPos by drawing a single visibility polygon"""
+    light = pygame.Surface((2*sightRange, 2*sightRange))
+    light.fill(BLACK)
+
+    polygon = returnVisibilityPolygon(playerPos, obsticles, sightRange)
+
+    # Move it so that the light position is at the center of the surface
+    polygon = [(x + sightRange, y + sightRange) for x, y in polygon]
+
+    pygame.draw.polygon(light, colour, polygon, 0)
+
+    return light
+
+def returnVisibilityPolygon(lightPos, obsticles, sightRange) -> list:
+    """Returns the visibility polygon around a light, relative to the light, by sweeping the obsticle edges by angle"""
+    segments = returnSweepSegments(lightPos, obsticles, sightRange)
+
+    # Each segment starts and ends at an angle, and the sweep handles ends before starts at the same angle
+    events = []
+    for i, (vertical, position, start, end) in enumerate(segments):
+        events.append((start, 1, i))
+        events.append((end, 0, i))
+    events.sort()
+
+    # The segments the sweeping ray crosses, nearest first
+    active = []
+
+    polygon = []
+    i = 0
+    while i < len(events):
+        angle = events[i][0]
+        front = active[0] if active else None
+
+        while i < len(events) and events[i][0] == angle:
+            _, isStart, index = events[i]
+            if isStart:
+                insertSegment(active, segments[index], angle)
+            else:
+                active.remove(segments[index])
+            i += 1
+
+        # The outline only turns where the nearest segment changes
+        newFront = active[0] if active else None
+        if newFront is not front:
+            if front:
+                polygon.append(returnSegmentPoint(front, angle))
+            if newFront:
+                polygon.append(returnSegmentPoint(newFront, angle))
+
+    return polygon
+
+def returnSweepSegments(lightPos, obsticles, sightRange) -> list:
+    """Returns the obsticle edges facing a light as segments of (vertical, position, start angle, end angle) relative to the light"""
+    lightX, lightY = lightPos
+
+    # The edges are all axis aligned, so keep vertical edges as (x, top, bottom) and horizontal edges as (y, left, right).
+    # The edges of the light's square stop every ray that gets that far
+    verticalEdges = [(-sightRange, -sightRange, sightRange), (sightRange, -sightRange, sightRange)]
+    horizontalEdges = [(-sightRange, -sightRange, sightRange), (sightRange, -sightRange, sightRange)]
+
+    # The obsticles that hide what is inside them, which is every one but those the light is inside
+    covers = []
+
+    for obsticle in obsticles:
+        if obsticle.isTransparent:
+            continue
+
+        # Get the obsticle's edges relative to the light
+        left = obsticle.position.x - lightX
+        top = obsticle.position.y - lightY
+        right = left + obsticle.size.x
+        bottom = top + obsticle.size.y
+
+        # Skip obsticles that are outside of the light
+        if right <= -sightRange or left >= sightRange or bottom <= -sightRange or top >= sightRange:
+            continue
+
+        inside = left < 0 < right and top < 0 < bottom
+        if not inside:
+            covers.append((left, top, right, bottom))
+
+        # Only the edges facing the light can be seen, unless the light is inside the obsticle,
+        # and only the parts of them inside the light's square
+        if left > 0 or inside:
+            verticalEdges.append((left, max(top, -sightRange), min(bottom, sightRange)))
+        if right < 0 or inside:
+            verticalEdges.append((right, max(top, -sightRange), min(bottom, sightRange)))
+        if top > 0 or inside:
+            horizontalEdges.append((top, max(left, -sightRange), min(right, sightRange)))
+        if bottom < 0 or inside:
+            horizontalEdges.append((bottom, max(left, -sightRange), min(right, sightRange)))
+
+    # Parts of edges inside another obsticle can never be seen. Cutting them away also leaves no two edges crossing,
+    # as only the edges of overlapping obsticles can, which the sweep needs to keep them in order of distance
+    covers = np.array(covers).reshape(-1, 4)
+    verticalPieces = returnUncoveredPieces(verticalEdges, covers[:, [0, 2, 1, 3]])
+    horizontalPieces = returnUncoveredPieces(horizontalEdges, covers[:, [1, 3, 0, 2]])
+
+    segments = []
+    for x, top, bottom in verticalPieces:
+        # The sweep starts and ends on the left of the light, so edges there are split where they cross it
+        ends = [top, 0, bottom] if x < 0 and top < 0 < bottom else [top, bottom]
+        for start, end in zip(ends, ends[1:]):
+            startAngle = returnSweepAngle(x, start, end)
+            endAngle = returnSweepAngle(x, end, start)
+            if startAngle != endAngle:
+                segments.append((True, x, min(startAngle, endAngle), max(startAngle, endAngle)))
+
+    for y, left, right in horizontalPieces:
+        startAngle = atan2(y, left)
+        endAngle = atan2(y, right)
+        if startAngle != endAngle:
+            segments.append((False, y, min(startAngle, endAngle), max(startAngle, endAngle)))
+
+    return segments
+
+def returnUncoveredPieces(edges, covers) -> list:
+    """Returns the parts of axis aligned edges of (position, start, end) outside every cover of (low, high, start, end),
+    the covers' low and high being across the edges and their start and end being along them"""
+    edgeArray = np.array(edges)
+    overlapping = (
+        (covers[None, :, 0] < edgeArray[:, None, 0]) & (edgeArray[:, None, 0] < covers[None, :, 1])
+        & (covers[None, :, 2] < edgeArray[:, None, 2]) & (edgeArray[:, None, 1] < covers[None, :, 3])
+    )
+
+    # Most edges near lots of obsticles are hidden by one of them, so drop those before cutting up the rest
+    wholeCovered = (overlapping & (covers[None, :, 2] <= edgeArray[:, None, 1]) & (edgeArray[:, None, 2] <= covers[None, :, 3])).any(axis=1)
+    overlapping[wholeCovered] = False
+    overlaps = np.nonzero(overlapping)
+    wholeCovered = wholeCovered.tolist()
+
+    hidden = {}
+    covers = covers.tolist()
+    for edge, cover in zip(*(indexes.tolist() for indexes in overlaps)):
+        hidden.setdefault(edge, []).append(covers[cover][2:])
+
+    pieces = []
+    for i, (position, start, end) in enumerate(edges):
+        if wholeCovered[i]:
+            continue
+
+        for low, high in sorted(hidden.get(i, ())):
+            if low > start:
+                pieces.append((position, start, low))
+            start = max(start, high)
+
+        if start < end:
+            pieces.append((position, start, end))
+
+    return pieces
+
+def returnSweepAngle(x, y, otherY) -> float:
+    """Return the angle of a point on a vertical segment, points left of the light being on the side of the rest of their segment"""
+    if y == 0 and x < 0:
+        return -pi if otherY < 0 else pi
+
+    return atan2(y, x)
+
+def returnSegmentDistance(segment, angle) -> float:
+    """Return how far along the ray at angle a segment is"""
+    vertical, position, _, _ = segment
+    return position / cos(angle) if vertical else position / sin(angle)
+
+def returnSegmentPoint(segment, angle) -> tuple:
+    """Return where the ray at angle crosses a segment"""
+    distance = returnSegmentDistance(segment, angle)
+    return (distance * cos(angle), distance * sin(angle))
+
+def insertSegment(active, segment, angle) -> None:
+    """Insert a segment starting at angle into the active segments, keeping them nearest first"""
+    low, high = 0, len(active)
+    while low < high:
+        middle = (low + high) // 2
+        other = active[middle]
+
+        # Segments that don't cross stay in the same order along every ray they share, so compare them
+        # halfway through the angles they share, away from any corner they might meet at
+        sharedAngle = (angle + min(segment[3], other[3])) / 2
+        if returnSegmentDistance(segment, sharedAngle) < returnSegmentDistance(other, sharedAngle):
+            high = middle
+        else:
+            low = middle + 1
+
+    active.insert(low, segment)
+
+def returnShaddowSight(playerPos, obsticles, sightRange, colour):
+    """Light the area visible from playerPos by drawing a shaddow for every obsticle edge"""
     # Create a new surface and set the black to transparent
     light = pygame.Surface((2*sightRange, 2*sightRange))
     light.fill(colour)
@@ -32,4 +290,71 @@ def returnPlayerSight(playerPos, obsticles, sightRange, colour):
         pygame.draw.polygon(light, BLACK, polygon, 0)
 
     # Return the surface
+    return light
+
+class ObsticleEdges:
+    """The edges of every non-transparent obsticle stored in contiguous arrays of shape (edges, 2)"""
+    def __init__(self, obsticles):
+        corners = [obsticle.cornerPositions for obsticle in obsticles if not obsticle.isTransparent]
+        corners = np.array(corners, dtype=np.float64).reshape(-1, 5, 2)
+
+        # The corners go round each obsticle and back to the first, so each edge runs from one corner to the next
+        self.starts = corners[:, :4].reshape(-1, 2)
+        self.ends = corners[:, 1:].reshape(-1, 2)
+
+# The edge arrays of the obsticle group they were made from, only kept until the obsticles change
+edgeCache = None
+
+def returnObsticleEdges(obsticles) -> ObsticleEdges:
+    global edgeCache
+
+    key = (obsticleVersion, id(obsticles))
+    if not edgeCache or edgeCache[0] != key:
+        edgeCache = (key, ObsticleEdges(obsticles))
+
+    return edgeCache[1]
+
+def returnNumpyShaddowPolygons(lightPos, obsticles, sightRange) -> np.ndarray:
+    """Returns the same shaddow polygons as Obsticle.returnShaddowPolygons for every edge at once, relative to the light, as an array of shape (shaddows, 6, 2)"""
+    edges = returnObsticleEdges(obsticles)
+
+    light = np.array((lightPos[0], lightPos[1]), dtype=np.float64)
+
+    starts = edges.starts - light
+    ends = edges.ends - light
+
+    startDistances = np.hypot(starts[:, 0], starts[:, 1])
+    endDistances = np.hypot(ends[:, 0], ends[:, 1])
+
+    # Keep the edges with a corner in range. Edges facing the light can't be culled, as the grid locked corners
+    # of their shaddows cover parts of the light the shaddows of the edges facing away don't, and the other way round
+    keep = ((startDistances < sightRange) | (endDistances < sightRange)) & (startDistances > 0) & (endDistances > 0)
+
+    starts = starts[keep]
+    ends = ends[keep]
+    startDirections = starts / startDistances[keep, None]
+    endDirections = ends / endDistances[keep, None]
+
+    # Project the edge away from the light, once along the ray and once locked to the grid as lockToGrid does
+    polygons = np.empty((len(starts), 6, 2))
+    polygons[:, 0] = starts
+    polygons[:, 1] = ends
+    polygons[:, 2] = ends + endDirections * sightRange
+    polygons[:, 3] = ends + np.sign(endDirections) * sightRange
+    polygons[:, 4] = starts + np.sign(startDirections) * sightRange
+    polygons[:, 5] = starts + startDirections * sightRange
+
+    return polygons
+
+def returnNumpySight(playerPos, obsticles, sightRange, colour):
+    """Light the area visible from playerPos by drawing shaddows computed for every edge at once"""
+    light = pygame.Surface((2*sightRange, 2*sightRange))
+    light.fill(colour)
+
+    # Move them so that the light position is at the center of the surface
+    polygons = returnNumpyShaddowPolygons(playerPos, obsticles, sightRange) + sightRange
+
+    for polygon in polygons.tolist():
+        pygame.draw.polygon(light, BLACK, polygon, 0)
+
     return light
\ No newline at end of file
@@ -0,0 +1,143 @@
+import cProfile
+import pstats
+import pygame
+import numpy as np
+
+from os import path, makedirs
+from time import perf_counter, strftime
+
+from settings import *
+
+# The parts of a frame timed by the render loop, in the order they happen
+FRAME_PHASES = ["idle", "events", "snapshot", "map", "sprites", "lighting", "minimap", "overlay", "flip"]
+# The parts of a round trip timed by the network thread
+NETWORK_PHASES = ["networkWait", "decode"]
+
+PROFILE_DIRECTORY = path.join(CACHE_DIRECTORY, "profiles")
+
+class RingBuffer:
+    """The last size values added, overwriting the oldest once full"""
+    def __init__(self, size):
+        self.values = np.zeros(size)
+        self.index = 0
+        self.count = 0
+
+    def add(self, value) -> None:
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def returnValues(self) -> np.ndarray:
+        return self.values[:self.count]
+
+    def returnMean(self) -> float:
+        return float(self.returnValues().mean()) if self.count else 0
+
+    def returnPercentile(self, percentile) -> float:
+        return float(np.percentile(self.returnValues(), percentile)) if self.count else 0
+
+class FrameProfiler:
+    """Times each phase of every frame into ring buffers, and can draw them over the game or run cProfile for a few frames"""
+    def __init__(self, size=PROFILER_FRAMES):
+        self.timings = {phase: RingBuffer(size) for phase in FRAME_PHASES + NETWORK_PHASES}
+        self.frameTimes = RingBuffer(size)
+
+        # The time spent in each phase so far this frame, as some phases are timed in more than one place
+        self.frame = dict.fromkeys(FRAME_PHASES, 0)
+        self.lastLap = perf_counter()
+
+        self.showOverlay = PROFILER_OVERLAY
+        self.overlay = None
+        self.overlayAge = 0
+        self.font = None
+
+        # The cProfile run in progress and how many more frames it runs for
+        self.profile = None
+        self.profileFrames = 0
+
+    def lap(self, phase) -> None:
+        """Add the time since the last lap to phase"""
+        now = perf_counter()
+        self.frame[phase] += now - self.lastLap
+        self.lastLap = now
+
+    def record(self, phase, seconds) -> None:
+        """Add a timing measured somewhere else, such as on the network thread"""
+        self.timings[phase].add(seconds)
+
+    def endFrame(self, deltaT) -> None:
+        """Store this frame's timings and start timing the next"""
+        self.frameTimes.add(deltaT)
+        for phase in FRAME_PHASES:
+            self.timings[phase].add(self.frame[phase])
+            self.frame[phase] = 0
+
+        if self.profile:
+            self.profileFrames -= 1
+            if self.profileFrames <= 0:
+                self.stopProfile()
+
+    def handleEvent(self, event) -> None:
+        if event.type != pygame.KEYDOWN:
+            return
+
+        if event.key == PROFILER_OVERLAY_KEY:
+            self.showOverlay = not self.showOverlay
+        elif event.key == PROFILER_CAPTURE_KEY and not self.profile:
+            self.startProfile(PROFILER_CAPTURE_FRAMES)
+
+    def startProfile(self, frames) -> None:
+        """Run cProfile over the next frames frames"""
+        self.profile = cProfile.Profile()
+        self.profileFrames = frames
+        self.profile.enable()
+
+    def stopProfile(self) -> str:
+        """Stop cProfile, save what it found and print the slowest functions, returning the file it was saved to"""
+        self.profile.disable()
+
+        makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        filename = path.join(PROFILE_DIRECTORY, f"client_{strftime('%Y%m%d_%H%M%S')}.prof")
+        self.profile.dump_stats(filename)
+
+        print(f"Saved profile to {filename}")
+        pstats.Stats(self.profile).sort_stats("cumulative").print_stats(20)
+
+        self.profile = None
+        return filename
+
+    def returnSummary(self) -> list:
+        """Return a line for the frame rate and each phase's mean and 99th percentile in milliseconds"""
+        meanFrameTime = self.frameTimes.returnMean()
+        lines = [f"{1/meanFrameTime if meanFrameTime else 0:5.1f} fps  {meanFrameTime*1000:5.2f} ms", f"{'phase':<12}{'mean':>6} {'p99':>6}"]
+
+        for phase, timings in self.timings.items():
+            lines.append(f"{phase:<12}{timings.returnMean()*1000:6.2f} {timings.returnPercentile(99)*1000:6.2f}")
+
+        if self.profile:
+            lines.append(f"profiling {self.profileFrames} frames")
+
+        return lines
+
+    def draw(self, surface) -> None:
+        if not self.showOverlay:
+            return
+
+        # Only render the text a few times a second, as rendering it every frame would show up in the timings
+        self.overlayAge -= 1
+        if self.overlay is None or self.overlayAge <= 0:
+            if self.font is None:
+                self.font = pygame.font.SysFont("Consolas", 14)
+
+            lines = [self.font.render(line, True, WHITE) for line in self.returnSummary()]
+            self.overlay = pygame.Surface((max(line.get_width() for line in lines) + 10, sum(line.get_height() for line in lines) + 10))
+            self.overlay.set_alpha(200)
+
+            y = 5
+            for line in lines:
+                self.overlay.blit(line, (5, y))
+                y += line.get_height()
+
+            self.overlayAge = PROFILER_OVERLAY_PERIOD
+
+        surface.blit(self.overlay, (10, 10))
\ No newline at end of file
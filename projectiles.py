@@ -0,0 +1,173 @@
+import numpy as np
+
+from math import cos, sin, pi
+
+from perception import RectArrays, returnHitTimes
+from settings import *
+
+def returnRunOffsets(counts) -> np.ndarray:
+    """Return the position of every item within its run, for consecutive runs of the given lengths"""
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+class ProjectilePool:
+    """Every bullet in flight stored in arrays, so they are all moved and collided at once each tick"""
+    def __init__(self, game, capacity=PROJECTILE_CAPACITY):
+        self.game = game
+
+        # Bullets are swept as a point against everything grown by half the bullet's size
+        self.imageSize = game.spriteImgs["bullet"].get_size()
+        self.padding = (self.imageSize[0] / 2, self.imageSize[1] / 2)
+
+        self.capacity = 0
+        self.positions = np.zeros((0, 2))
+        self.directions = np.zeros((0, 2))
+        self.angles = np.zeros(0)
+        self.ranges = np.zeros(0)
+        self.networkIds = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.owners = []
+
+        # The slots that aren't in use, taken from the end so recently freed ones are reused first
+        self.freeSlots = []
+        self.grow(capacity)
+
+    def grow(self, capacity) -> None:
+        """Make room for capacity bullets, only needed if more are in flight at once than ever before"""
+        extra = capacity - self.capacity
+
+        self.positions = np.concatenate((self.positions, np.zeros((extra, 2))))
+        self.directions = np.concatenate((self.directions, np.zeros((extra, 2))))
+        self.angles = np.concatenate((self.angles, np.zeros(extra)))
+        self.ranges = np.concatenate((self.ranges, np.zeros(extra)))
+        self.networkIds = np.concatenate((self.networkIds, np.zeros(extra, dtype=np.int64)))
+        self.alive = np.concatenate((self.alive, np.zeros(extra, dtype=bool)))
+        self.owners.extend([None] * extra)
+
+        self.freeSlots = list(range(capacity - 1, self.capacity - 1, -1)) + self.freeSlots
+        self.capacity = capacity
+
+    def spawn(self, owner, position, angle, range) -> int:
+        """Fire a bullet and return the slot it is stored in"""
+        if not self.freeSlots:
+            self.grow(self.capacity * 2)
+
+        slot = self.freeSlots.pop()
+
+        self.positions[slot] = (position[0], position[1])
+        # The same direction rotateVector2(Vector2(0, 1), -angle - 90) gives
+        self.directions[slot] = (cos(-angle * pi/180), sin(-angle * pi/180))
+        self.angles[slot] = angle
+        self.ranges[slot] = range
+        self.networkIds[slot] = next(self.game.networkIds)
+        self.alive[slot] = True
+        self.owners[slot] = owner
+
+        return slot
+
+    def free(self, slot) -> None:
+        self.alive[slot] = False
+        self.owners[slot] = None
+        self.freeSlots.append(slot)
+
+    def returnCandidates(self, grid, starts, ends) -> tuple:
+        """Return the index of the bullet and the sprite of every pair of a bullet and a sprite in the grid cells its swept segment covers"""
+        # The range of cells each bullet's swept segment covers, grown by the bullet's size
+        lefts = (np.floor(np.minimum(starts[:, 0], ends[:, 0]) - self.padding[0]) // grid.cellSize).astype(np.int64)
+        tops = (np.floor(np.minimum(starts[:, 1], ends[:, 1]) - self.padding[1]) // grid.cellSize).astype(np.int64)
+        rights = (np.ceil(np.maximum(starts[:, 0], ends[:, 0]) + self.padding[0]) // grid.cellSize).astype(np.int64)
+        bottoms = (np.ceil(np.maximum(starts[:, 1], ends[:, 1]) + self.padding[1]) // grid.cellSize).astype(np.int64)
+
+        # Every cell in every range, as the bullet it belongs to and a key for the cell
+        widths = rights - lefts + 1
+        heights = bottoms - tops + 1
+        bulletIndexes = np.repeat(np.arange(len(starts)), widths * heights)
+        offsets = returnRunOffsets(widths * heights)
+        cellXs = lefts[bulletIndexes] + offsets % widths[bulletIndexes]
+        cellYs = tops[bulletIndexes] + offsets // widths[bulletIndexes]
+
+        minX, minY = lefts.min(), tops.min()
+        rows = bottoms.max() - minY + 1
+        cellKeys, cellIndexes = np.unique((cellXs - minX) * rows + (cellYs - minY), return_inverse=True)
+
+        # Look up each cell once however many bullets pass through it, numbering the sprites found
+        spriteNumbers = {}
+        cellSprites = []
+        for key in cellKeys.tolist():
+            cell = grid.cells.get((int(key // rows + minX), int(key % rows + minY)), ())
+            cellSprites.append([spriteNumbers.setdefault(sprite, len(spriteNumbers)) for sprite in cell])
+
+        grid.queries += len(starts)
+        grid.bruteForcePairs += len(starts) * len(grid.spriteCells)
+
+        sprites = list(spriteNumbers)
+        if not sprites:
+            return np.zeros(0, dtype=np.int64), []
+
+        # Pair each bullet with the sprites of each of its cells
+        cellCounts = np.array([len(numbers) for numbers in cellSprites], dtype=np.int64)
+        cellStarts = np.cumsum(cellCounts) - cellCounts
+        numbers = np.fromiter((number for numbers in cellSprites for number in numbers), dtype=np.int64)
+
+        pairCounts = cellCounts[cellIndexes]
+        pairBullets = np.repeat(bulletIndexes, pairCounts)
+        pairSprites = numbers[np.repeat(cellStarts[cellIndexes], pairCounts) + returnRunOffsets(pairCounts)]
+
+        # A sprite spanning several of a bullet's cells is only paired with it once
+        pairs = np.unique(pairBullets * len(sprites) + pairSprites)
+        grid.candidatePairs += len(pairs)
+
+        return pairs // len(sprites), [sprites[number] for number in (pairs % len(sprites)).tolist()]
+
+    def update(self, deltaT, obsticleGrid, characterGrid) -> None:
+        """Move every bullet, hurting the first character each one hits and stopping them at walls or their range"""
+        slots = np.flatnonzero(self.alive)
+        if not len(slots):
+            return
+
+        # Sweep each bullet along the segment it moves this tick, cut short by its remaining range
+        distances = np.minimum(BULLET_SPEED * deltaT, self.ranges[slots])
+        starts = self.positions[slots]
+        moves = self.directions[slots] * distances[:, None]
+
+        # The first wall each bullet touches, only testing the walls in the cells it passes through
+        wallTimes = np.full(len(slots), np.inf)
+        bulletIndexes, walls = self.returnCandidates(obsticleGrid, starts, starts + moves)
+        if walls:
+            times = returnHitTimes(starts[bulletIndexes], moves[bulletIndexes], RectArrays([wall.rect for wall in walls], self.padding), True)
+            np.minimum.at(wallTimes, bulletIndexes, times)
+
+        # The first character each bullet touches, other than the one that fired it
+        firstCharacters = {}
+        firstCharacterTimes = np.full(len(slots), np.inf)
+        bulletIndexes, characters = self.returnCandidates(characterGrid, starts, starts + moves)
+        if characters:
+            times = returnHitTimes(starts[bulletIndexes], moves[bulletIndexes], RectArrays([character.rect for character in characters], self.padding), True)
+
+            for pair in np.flatnonzero(np.isfinite(times)):
+                i = bulletIndexes[pair]
+                if characters[pair] is not self.owners[slots[i]] and times[pair] < firstCharacterTimes[i]:
+                    firstCharacterTimes[i] = times[pair]
+                    firstCharacters[i] = characters[pair]
+
+        self.positions[slots] = starts + moves
+        self.ranges[slots] -= distances
+
+        # Hurt the characters that were hit before a wall
+        for i, character in firstCharacters.items():
+            if firstCharacterTimes[i] <= wallTimes[i]:
+                character.health -= BULLET_DAMAGE
+
+        # Stop every bullet that hit something or went out of range
+        finished = np.isfinite(wallTimes) | np.isfinite(firstCharacterTimes) | (self.ranges[slots] <= 0)
+        for slot in slots[finished]:
+            self.free(slot)
+
+    def returnView(self) -> tuple:
+        """Return the ids, top left corners and angles of every bullet in flight, as sent in snapshots"""
+        slots = np.flatnonzero(self.alive)
+
+        # Where a rect of the bullet's size centered on it would be
+        lefts = np.floor(self.positions[slots, 0] + 0.5).astype(np.int64) - self.imageSize[0] // 2
+        tops = np.floor(self.positions[slots, 1] + 0.5).astype(np.int64) - self.imageSize[1] // 2
+
+        return self.networkIds[slots], lefts, tops, self.angles[slots]
\ No newline at end of file
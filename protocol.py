@@ -0,0 +1,389 @@
+import struct
+import asyncio
+
+from json import loads, dumps
+from collections import OrderedDict
+
+from assets import CHARACTER_NAMES, CHARACTER_VARIATIONS, OBJECT_NAMES
+
+# Bumped whenever the layout of a message changes
+PROTOCOL_VERSION = 2
+
+# Protocol modes, JSON is kept for debugging
+MODE_BINARY = 0
+MODE_JSON = 1
+
+PROTOCOL_MODES = {"binary": MODE_BINARY, "json": MODE_JSON}
+
+# The largest frame that will be accepted, so a bad length can't make us allocate gigabytes
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# Every image the server can tell a client to draw, sent as its index in this table
+IMAGE_NAMES = ["None"] + [f"{character}_{variation}" for character in CHARACTER_NAMES for variation in CHARACTER_VARIATIONS] + OBJECT_NAMES
+IMAGE_IDS = {name: index for index, name in enumerate(IMAGE_NAMES)}
+
+# Message layouts
+FRAME_HEADER = struct.Struct("!I")
+HELLO = struct.Struct("!2sBB")
+INPUT = struct.Struct("!ffHI")
+SNAPSHOT_HEADER = struct.Struct("!?IIIII")
+ENTITY = struct.Struct("!IBHiiH")
+ENTITY_ID = struct.Struct("!I")
+CHANGE_HEADER = struct.Struct("!IB")
+
+# How each field of an entity's state (focus, image, x, y, angle) is packed when it changes
+FIELD_STRUCTS = [struct.Struct("!B"), struct.Struct("!H"), struct.Struct("!i"), struct.Struct("!i"), struct.Struct("!H")]
+
+# How many sent snapshots are remembered for clients to acknowledge
+SNAPSHOT_HISTORY = 32
+
+HELLO_MAGIC = b"SG"
+
+# Angles are sent as a fraction of a turn
+ANGLE_SCALE = 65536 / 360
+
+class ProtocolError(ConnectionError):
+    pass
+
+class SnapshotEncoder:
+    """Makes the snapshots sent to one client, as changes since the last snapshot it acknowledged"""
+    def __init__(self):
+        self.sequence = 0
+
+        # The states of the entities in each recently sent snapshot
+        self.history = OrderedDict()
+
+    def makeSnapshotFromState(self, state, ack) -> dict:
+        """Return a snapshot message of a dictionary of entity states, each (focus, image, left, top, angle) as WorldSnapshot makes them"""
+        self.sequence += 1
+        self.history[self.sequence] = state
+        if len(self.history) > SNAPSHOT_HISTORY:
+            self.history.popitem(last=False)
+
+        base = self.history.get(ack)
+
+        # Send everything if the client hasn't got a snapshot we still remember
+        if base is None:
+            return {
+                "keyframe": True,
+                "sequence": self.sequence,
+                "base": 0,
+                "spawned": [[entityId, *entity] for entityId, entity in state.items()],
+                "despawned": [],
+                "changed": [],
+            }
+
+        spawned = []
+        changed = []
+        for entityId, entity in state.items():
+            oldEntity = base.get(entityId)
+            if oldEntity is None:
+                spawned.append([entityId, *entity])
+            elif oldEntity != entity:
+                changed.append([entityId, [[i, value] for i, value in enumerate(entity) if value != oldEntity[i]]])
+
+        return {
+            "keyframe": False,
+            "sequence": self.sequence,
+            "base": ack,
+            "spawned": spawned,
+            "despawned": [entityId for entityId in base if entityId not in state],
+            "changed": changed,
+        }
+
+class SnapshotDecoder:
+    """Keeps a client's table of entities up to date from the snapshots the server sends"""
+    def __init__(self):
+        # The sequence number of the last snapshot that was applied, which is sent back as an acknowledgement
+        self.sequence = 0
+
+        self.entities = {}
+
+    def apply(self, snapshot) -> None:
+        if not snapshot:
+            return
+
+        if snapshot["keyframe"]:
+            self.entities = {}
+        elif snapshot["base"] != self.sequence:
+            # This was made from a snapshot we don't have, so wait for the keyframe the server will send next
+            return
+
+        for entityId, *entity in snapshot["spawned"]:
+            self.entities[entityId] = list(entity)
+
+        for entityId in snapshot["despawned"]:
+            self.entities.pop(entityId, None)
+
+        for entityId, fields in snapshot["changed"]:
+            entity = self.entities[entityId]
+            for i, value in fields:
+                entity[i] = value
+
+        self.sequence = snapshot["sequence"]
+
+    def returnInfoList(self) -> list:
+        """Return the entities as sprite dictionaries"""
+        return [
+            {
+                "id": entityId,
+                "focus": bool(focus),
+                "image": image,
+                "position": [x, y],
+                "angle": angle / ANGLE_SCALE,
+            }
+            for entityId, (focus, image, x, y, angle) in self.entities.items()
+        ]
+
+def packKeys(keys) -> int:
+    """Pack the mouse buttons and keys of an input list into a bit field"""
+    bits = list(keys[0][1]) + list(keys[1]) + list(keys[2]) + list(keys[3]) + list(keys[4]) + keys[5:9]
+
+    field = 0
+    for i, bit in enumerate(bits):
+        if bit:
+            field |= 1 << i
+
+    return field
+
+def unpackKeys(mouseX, mouseY, field) -> list:
+    """Turn a bit field back into the input list the client sent"""
+    bits = [(field >> i) & 1 for i in range(15)]
+
+    return [
+        [[mouseX, mouseY], bits[0:3]],
+        bits[3:5],
+        bits[5:7],
+        bits[7:9],
+        bits[9:11],
+        bits[11],
+        bits[12],
+        bits[13],
+        bits[14],
+    ]
+
+def makeFrame(payload) -> bytes:
+    """Prefix a payload with its length"""
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def readFrameSize(header) -> int:
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {size} bytes is too large")
+
+    return size
+
+def makeHello(mode) -> bytes:
+    return HELLO.pack(HELLO_MAGIC, PROTOCOL_VERSION, mode)
+
+def readHello(frame) -> int:
+    """Return the mode asked for in a hello message"""
+    if len(frame) != HELLO.size:
+        raise ProtocolError("Expected a hello message")
+
+    magic, version, mode = HELLO.unpack(frame)
+    if magic != HELLO_MAGIC or version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if mode not in PROTOCOL_MODES.values():
+        raise ProtocolError(f"Unknown protocol mode {mode}")
+
+    return mode
+
+def makeInput(keys, ack, mode) -> bytes:
+    """Encode key presses along with the sequence number of the last snapshot that was applied"""
+    if mode == MODE_JSON:
+        return dumps({"keys": keys, "ack": ack}).encode()
+
+    return INPUT.pack(keys[0][0][0], keys[0][0][1], packKeys(keys), ack)
+
+def readInput(frame, mode) -> tuple:
+    """Return the key presses and acknowledgement encoded by makeInput"""
+    if mode == MODE_JSON:
+        message = loads(str(frame, "utf-8"))
+        return message["keys"], message["ack"]
+
+    mouseX, mouseY, field, ack = INPUT.unpack(frame)
+    return unpackKeys(mouseX, mouseY, field), ack
+
+def packEntity(entityId, focus, image, x, y, angle) -> bytes:
+    return ENTITY.pack(entityId, focus, IMAGE_IDS[image], x, y, angle)
+
+def makeSnapshotPayload(snapshot, mode, packedEntities=None) -> bytes:
+    """Encode a snapshot made by a SnapshotEncoder, reusing entities already packed by packEntity without focus"""
+    if mode == MODE_JSON:
+        return dumps(snapshot).encode()
+
+    payload = bytearray(SNAPSHOT_HEADER.pack(snapshot["keyframe"], snapshot["sequence"], snapshot["base"], len(snapshot["spawned"]), len(snapshot["despawned"]), len(snapshot["changed"])))
+
+    for entity in snapshot["spawned"]:
+        if packedEntities and not entity[1]:
+            payload += packedEntities[entity[0]]
+        else:
+            payload += packEntity(*entity)
+
+    for entityId in snapshot["despawned"]:
+        payload += ENTITY_ID.pack(entityId)
+
+    # Changes are sent as a bit mask of the fields that changed followed by just those fields
+    for entityId, fields in snapshot["changed"]:
+        mask = 0
+        for i, _ in fields:
+            mask |= 1 << i
+        payload += CHANGE_HEADER.pack(entityId, mask)
+
+        for i, value in fields:
+            payload += FIELD_STRUCTS[i].pack(IMAGE_IDS[value] if i == 1 else value)
+
+    return bytes(payload)
+
+def readSnapshot(frame, mode) -> dict:
+    """Return the snapshot encoded by makeSnapshotPayload"""
+    if mode == MODE_JSON:
+        return loads(str(frame, "utf-8"))
+
+    try:
+        keyframe, sequence, base, spawnedCount, despawnedCount, changedCount = SNAPSHOT_HEADER.unpack_from(frame, 0)
+        offset = SNAPSHOT_HEADER.size
+
+        spawned = []
+        for _ in range(spawnedCount):
+            entityId, focus, imageId, x, y, angle = ENTITY.unpack_from(frame, offset)
+            spawned.append([entityId, focus, IMAGE_NAMES[imageId], x, y, angle])
+            offset += ENTITY.size
+
+        despawned = []
+        for _ in range(despawnedCount):
+            despawned.append(ENTITY_ID.unpack_from(frame, offset)[0])
+            offset += ENTITY_ID.size
+
+        changed = []
+        for _ in range(changedCount):
+            entityId, mask = CHANGE_HEADER.unpack_from(frame, offset)
+            offset += CHANGE_HEADER.size
+
+            fields = []
+            for i, fieldStruct in enumerate(FIELD_STRUCTS):
+                if mask & (1 << i):
+                    value = fieldStruct.unpack_from(frame, offset)[0]
+                    fields.append([i, IMAGE_NAMES[value] if i == 1 else value])
+                    offset += fieldStruct.size
+            changed.append([entityId, fields])
+    except (struct.error, IndexError):
+        raise ProtocolError("Snapshot is malformed")
+
+    return {
+        "keyframe": keyframe,
+        "sequence": sequence,
+        "base": base,
+        "spawned": spawned,
+        "despawned": despawned,
+        "changed": changed,
+    }
+
+class Connection:
+    """A socket that sends and receives length prefixed frames"""
+    def __init__(self, connection, mode=MODE_BINARY, stats=None):
+        self.socket = connection
+        self.mode = mode
+
+        # Where the traffic is counted, if anywhere
+        self.stats = stats
+
+        # A receive buffer that is reused for every frame and only grows
+        self.buffer = bytearray(4096)
+        self.view = memoryview(self.buffer)
+
+    def sendFrame(self, payload) -> None:
+        frame = makeFrame(payload)
+        self.socket.sendall(frame)
+
+        if self.stats:
+            self.stats.addSent(len(frame))
+
+    def recvExactly(self, size) -> memoryview:
+        """Receive exactly size bytes into the receive buffer"""
+        if size > len(self.buffer):
+            self.buffer = bytearray(max(size, len(self.buffer) * 2))
+            self.view = memoryview(self.buffer)
+
+        received = 0
+        while received < size:
+            count = self.socket.recv_into(self.view[received:size], size - received)
+            if not count:
+                raise ConnectionError("Connection closed")
+            received += count
+
+        return self.view[:size]
+
+    def recvFrame(self) -> memoryview:
+        """Receive one frame, which is only valid until the next frame is received"""
+        frame = self.recvExactly(readFrameSize(self.recvExactly(FRAME_HEADER.size)))
+
+        if self.stats:
+            self.stats.addReceived(FRAME_HEADER.size + len(frame))
+
+        return frame
+
+    def requestHandshake(self, mode) -> None:
+        """Ask the server to talk in a mode and use the mode it agrees to"""
+        self.sendFrame(makeHello(mode))
+        self.mode = readHello(self.recvFrame())
+
+    def acceptHandshake(self) -> None:
+        """Agree to the mode the client asked for"""
+        self.mode = readHello(self.recvFrame())
+        self.sendFrame(makeHello(self.mode))
+
+    def sendInput(self, keys, ack) -> None:
+        self.sendFrame(makeInput(keys, ack, self.mode))
+
+    def recvInput(self) -> tuple:
+        return readInput(self.recvFrame(), self.mode)
+
+    def recvSnapshot(self) -> dict:
+        return readSnapshot(self.recvFrame(), self.mode)
+
+    def close(self) -> None:
+        self.socket.close()
+
+class AsyncConnection:
+    """An asyncio stream that sends and receives length prefixed frames"""
+    def __init__(self, reader, writer, mode=MODE_BINARY, stats=None):
+        self.reader = reader
+        self.writer = writer
+        self.mode = mode
+
+        # Where the traffic is counted, if anywhere
+        self.stats = stats
+
+    async def recvFrame(self) -> bytes:
+        try:
+            header = await self.reader.readexactly(FRAME_HEADER.size)
+            frame = await self.reader.readexactly(readFrameSize(header))
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Connection closed")
+
+        if self.stats:
+            self.stats.addReceived(FRAME_HEADER.size + len(frame))
+
+        return frame
+
+    async def sendFrame(self, payload) -> None:
+        frame = makeFrame(payload)
+        self.writer.write(frame)
+
+        if self.stats:
+            self.stats.addSent(len(frame))
+
+        await self.writer.drain()
+
+    async def acceptHandshake(self) -> None:
+        """Agree to the mode the client asked for"""
+        self.mode = readHello(await self.recvFrame())
+        await self.sendFrame(makeHello(self.mode))
+
+    async def recvInput(self) -> tuple:
+        return readInput(await self.recvFrame(), self.mode)
+
+    def close(self) -> None:
+        self.writer.close()
\ No newline at end of file
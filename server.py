@@ -1,31 +1,48 @@
+import os
+import sys
 import socket
+import signal
+import asyncio
 from _thread import *
+from time import perf_counter, sleep
 
-from json import loads, dumps
+# Unless asked for a window the server runs headless, using SDL's dummy drivers only to convert images
+HEADLESS = "--windowed" not in sys.argv
+if HEADLESS:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
 
 from game import Game
 from sprites import *
+from protocol import Connection, AsyncConnection, SnapshotEncoder, makeSnapshotPayload
+from telemetry import MetricsServer
 
-def readInfo(positions) -> list:
-    """A function that turns a string into a list"""
+class AreaOfInterest:
+    """The entities one client is sent, picked by distance from its player with hysteresis so they don't flicker"""
+    def __init__(self, enterRadius, leaveRadius):
+        self.enterRadius = enterRadius
+        self.leaveRadius = leaveRadius
 
-    return loads(positions)
+        self.visible = set()
+        # Where the client's player last was, used once their player has left the world
+        self.center = (0, 0)
 
-def makeInfo(positions) -> str:
-    """A function that turns a list into a string"""
+    def update(self, world, focusId, center) -> set:
+        """Return the ids of the entities near center, keeping ones already visible until they are past the leave radius"""
+        visible = {focusId}
+        for entityId in world.query(center, self.leaveRadius):
+            radius = self.leaveRadius if entityId in self.visible else self.enterRadius
 
-    return dumps(positions)
+            entityCenter = world.centers[entityId]
+            if (center[0] - entityCenter[0]) ** 2 + (center[1] - entityCenter[1]) ** 2 <= radius * radius:
+                visible.add(entityId)
 
-def fillDictionary(focus, spriteImage, pos, angle) -> dict:
-    return {
-        "focus": focus,
-        "image": spriteImage,
-        "position": pos,
-        "angle": angle,
-    }
+        self.visible = visible
+        self.center = center
+        return visible
 
 class Server():
-    def __init__(self):
+    def __init__(self, mode=SERVER_MODE, headless=HEADLESS):
         self.host = "127.0.0.1"# "127.0.0.1"  # Standard loopback interface address (localhost)
         self.port = 1024  # Port to listen on (non-privileged ports are > 1023)
 
@@ -40,31 +57,81 @@ class Server():
 
         self.players = []
 
-        self.game = Game()
+        self.game = Game(headless)
 
-        start_new_thread(self.runGame, ())
+        # Serve how the server is performing for monitoring
+        if TELEMETRY_PORT is not None:
+            self.metricsServer = MetricsServer(self.game)
 
-        # Start accepting users
-        self.startAccepting()
+        self.handleSignals()
+
+        if mode == "asyncio":
+            # Run the game and every connection in one event loop
+            asyncio.run(self.serveAsync())
+        else:
+            start_new_thread(self.runGame, ())
+
+            # Start accepting users
+            self.startAccepting()
+
+    def handleSignals(self):
+        """Stop the whole server on SIGTERM or SIGINT, rather than letting SDL turn them into a quit event only the game sees"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.onSignal)
+
+    def onSignal(self, signum, frame):
+        print(f"Stopping on {signal.Signals(signum).name}")
+        self.stop()
+
+        # Unwinds the accept loop or the event loop in the main thread, the game and connection threads end with the process
+        sys.exit(0)
+
+    def stop(self):
+        self.acceptingNewConnections = False
+        self.game.running = False
+
+        if TELEMETRY_PORT is not None:
+            self.metricsServer.stop()
 
     def runGame(self):
-        while True:
+        while self.acceptingNewConnections:
             self.game.new()
             self.game.run()
 
-    def collectSpriteInfo(self, focus):
-        infoList = []
+    def collectSpriteState(self, world, focusId, interest=None) -> dict:
+        """Return the states of every entity in a world snapshot, or only the ones in a client's area of interest"""
+        if interest:
+            center = world.centers.get(focusId, interest.center)
+            entityIds = sorted(interest.update(world, focusId, center), key=lambda entityId: world.order.get(entityId, -1))
+            state = {entityId: world.states[entityId] for entityId in entityIds if entityId in world.states}
+        else:
+            state = dict(world.states)
+
+        # Let the client know which character it is controlling
+        if focusId in state:
+            state[focusId] = (1, *state[focusId][1:])
+
+        return state
 
-        # Add all characters
-        for sprite in self.game.all_characters:
-            infoList.append(fillDictionary(sprite is focus, f"{sprite.characterName}_{sprite.imageKey}", list(sprite.rect.topleft), sprite.angle))
+    def encodeSnapshot(self, world, slot, interest, snapshots, ack, mode) -> bytes:
+        """Build and encode the snapshot of a world snapshot a client is sent, timing how long it takes"""
+        start = perf_counter()
+        payload = makeSnapshotPayload(snapshots.makeSnapshotFromState(self.collectSpriteState(world, slot.networkId, interest), ack), mode, world.packed)
+        self.game.telemetry.recordSerialization(perf_counter() - start)
 
-        # Add all moveable objects
-        for sprite in self.game.all_sprites:
-            if isinstance(sprite, (Object, Bullet)):
-                infoList.append(fillDictionary(False, sprite.imageName, list(sprite.rect.topleft), sprite.angle))
+        return payload
 
-        return infoList
+    def returnJoinedSnapshot(self, slot):
+        """Return the latest world snapshot if the slot's player is in it yet, or None"""
+        if slot.networkId is None:
+            return None
+
+        world = self.game.getSnapshot()
+        return world if slot.networkId in world.states else None
+
+    def removePlayer(self, slot):
+        self.players.remove(slot)
+        self.game.queueLeave(slot)
 
     def startAccepting(self):
         # Create a socket stream
@@ -86,32 +153,164 @@ class Server():
     def threaded_client(self, connection, userIndex):
         """Recieves position updates from players and sends back positions of other users"""
 
-        self.players.append(Player(self.game, self.game.spawnPoint, self.game.characterImgs))
+        # Count the traffic of the connection
+        stats = self.game.telemetry.addConnection(connection.getpeername())
+        connection = Connection(connection, stats=stats)
+
+        try:
+            # Agree on how to talk to the client
+            connection.acceptHandshake()
+        except Exception as e:
+            print(e)
+            self.game.telemetry.removeConnection(stats)
+            connection.close()
+            return
+
+        # The game thread spawns the player, this thread only ever reads world snapshots
+        slot = self.game.queueJoin()
+        self.players.append(slot)
+
+        # Snapshots are sent as changes since the last one the client acknowledged, and only contain what's near the player
+        snapshots = SnapshotEncoder()
+        interest = AreaOfInterest(INTEREST_RADIUS, INTEREST_RADIUS + INTEREST_HYSTERESIS)
+        latency = self.game.telemetry.returnInputLatency()
         
-        # Make a connection to the client
-        connection.send(makeInfo(fillDictionary(True, f"{self.players[userIndex].characterName}_{self.players[userIndex].imageKey}", list(self.players[userIndex].rect.topleft), self.players[userIndex].angle)).encode())
+        # Make a connection to the client, starting with a keyframe from the first tick that has the player in it
+        world = self.returnJoinedSnapshot(slot)
+        while world is None:
+            sleep(1 / SERVER_TICK_RATE)
+            world = self.returnJoinedSnapshot(slot)
+
+        connection.sendFrame(self.encodeSnapshot(world, slot, interest, snapshots, None, connection.mode))
         while True:
             try:
-                # Decode the coordinates sent by the client
-                keyPresses = readInfo(connection.recv(2048).decode())
-                # Send key inputs to the client's player
-                self.players[userIndex].get_input(keyPresses)
-
-                if not keyPresses:
-                    print("Disconected")
-                    break
+                # Decode the key presses sent by the client and queue them for the client's player
+                keyPresses, ack = connection.recvInput()
+                self.game.queueInput(slot, keyPresses)
+                latency.addInput(self.game.tick, perf_counter())
+
+                # Send the reply, only reading the latest world snapshot
+                world = self.game.getSnapshot()
+                connection.sendFrame(self.encodeSnapshot(world, slot, interest, snapshots, ack, connection.mode))
+                latency.addSnapshot(world.tick, perf_counter())
+
+            except Exception as e:
+                print(e)
+                break
+
+        print("Lost connection")
+        self.removePlayer(slot)
+        self.game.telemetry.removeConnection(stats)
+        connection.close()
+
+    async def serveAsync(self):
+        """Accept connections and run the game as tasks on one event loop"""
+        server = await asyncio.start_server(self.handleClient, self.host, self.port)
+        print("Waiting for connections")
+
+        self.gameTask = asyncio.create_task(self.runGameAsync())
+
+        async with server:
+            await server.serve_forever()
+
+    async def runGameAsync(self):
+        """Tick the game, giving the rest of each tick to the connections"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self.game.new()
+            self.game.running = True
+
+            lastTickTime = loop.time()
+            while self.game.running:
+                tickTime = loop.time()
+
+                if self.game.headless:
+                    # Run the fixed ticks that are due and sleep until the next one
+                    await asyncio.sleep(self.game.advance(tickTime - lastTickTime))
                 else:
-                    reply = makeInfo(self.collectSpriteInfo(self.players[userIndex]))
+                    self.game.deltaT = tickTime - lastTickTime
+                    self.game.step()
+
+                    await asyncio.sleep(max(0, 1/FPS - (loop.time() - tickTime)))
+
+                lastTickTime = tickTime
+
+    async def handleClient(self, reader, writer):
+        """Recieves position updates from a player and queues the replies to be sent"""
+        address = writer.get_extra_info("peername")
+        print(f"Connected to: {address[0]}:{address[1]}")
+
+        # Count the traffic of the connection
+        stats = self.game.telemetry.addConnection(address)
+        connection = AsyncConnection(reader, writer, stats=stats)
+
+        try:
+            # Agree on how to talk to the client
+            await connection.acceptHandshake()
+        except Exception as e:
+            print(e)
+            self.game.telemetry.removeConnection(stats)
+            connection.close()
+            return
+
+        # The player is spawned at the start of the next tick, with everything else that changes the sprites
+        slot = self.game.queueJoin()
+        self.players.append(slot)
 
-                # Send the reply
-                connection.sendall(reply.encode())
+        # Snapshots are sent as changes since the last one the client acknowledged, and only contain what's near the player
+        snapshots = SnapshotEncoder()
+        interest = AreaOfInterest(INTEREST_RADIUS, INTEREST_RADIUS + INTEREST_HYSTERESIS)
+        latency = self.game.telemetry.returnInputLatency()
+
+        # Replies are sent by their own task so a slow client can't hold up reading
+        sendQueue = asyncio.Queue(SEND_QUEUE_SIZE)
+        sender = asyncio.create_task(self.sendQueued(connection, sendQueue))
+
+        # Start with a keyframe from the first tick that has the player in it
+        world = self.returnJoinedSnapshot(slot)
+        while world is None:
+            await asyncio.sleep(1 / SERVER_TICK_RATE)
+            world = self.returnJoinedSnapshot(slot)
+
+        self.queueFrame(sendQueue, self.encodeSnapshot(world, slot, interest, snapshots, None, connection.mode))
+        while True:
+            try:
+                # Decode the key presses sent by the client and queue them for the client's player
+                keyPresses, ack = await connection.recvInput()
+                self.game.queueInput(slot, keyPresses)
+                latency.addInput(self.game.tick, perf_counter())
+
+                # Queue the reply, only reading the latest world snapshot
+                world = self.game.getSnapshot()
+                self.queueFrame(sendQueue, self.encodeSnapshot(world, slot, interest, snapshots, ack, connection.mode))
+                latency.addSnapshot(world.tick, perf_counter())
 
             except Exception as e:
                 print(e)
                 break
 
         print("Lost connection")
+        self.removePlayer(slot)
+        self.game.telemetry.removeConnection(stats)
+        sender.cancel()
         connection.close()
 
+    def queueFrame(self, sendQueue, payload):
+        # Drop the oldest reply if the client isn't keeping up, it catches up from the next snapshot it acknowledges
+        if sendQueue.full():
+            sendQueue.get_nowait()
+
+        sendQueue.put_nowait(payload)
+
+    async def sendQueued(self, connection, sendQueue):
+        while True:
+            payload = await sendQueue.get()
+
+            try:
+                await connection.sendFrame(payload)
+            except (ConnectionError, OSError):
+                return
+
 if __name__ == "__main__":
     s = Server()
\ No newline at end of file
@@ -1,5 +1,7 @@
 import pygame
 
+from os import path
+
 # Window variables setup
 FPS = 60
 
@@ -19,4 +21,95 @@ TILESIZE = 64
 CHARACTER_SPEED = 75
 FLOOR_FRICTION = 0.6
 
-CHARACTER_COL_RECT = pygame.Rect(0, 0, TILESIZE*3/4, TILESIZE*3/4)
\ No newline at end of file
+CHARACTER_COL_RECT = pygame.Rect(0, 0, TILESIZE*3/4, TILESIZE*3/4)
+
+# Size of a cell in the collision spatial hash
+GRID_CELL_SIZE = TILESIZE * 2
+
+# Which renderer draws the player's sight, either "sweep" (one visibility polygon), "shaddows" (one polygon per obsticle edge)
+# or "numpy" (the shaddow polygons computed for every edge in one batch)
+LIGHTING_BACKEND = "sweep"
+
+# Player lights are cached by position rounded to this many pixels, using at most this many bytes
+LIGHTING_CACHE_QUANTUM = 1
+LIGHTING_CACHE_BUDGET = 64 * 1024 * 1024
+
+# Where generated assets are stored between launches
+CACHE_DIRECTORY = path.join(path.dirname(__file__), "cache")
+
+# The map the game is played on
+MAP_FILE = path.join(path.dirname(__file__), "maps", "main map.tmx")
+
+# Maps are drawn in square chunks of this many pixels, keeping at most this many bytes of them in memory
+MAP_CHUNK_SIZE = 512
+MAP_CHUNK_BUDGET = 128 * 1024 * 1024
+
+# Sprites are pre-rotated to this many angles, either on first use within the memory budget or all up front,
+# optionally packed into one atlas surface
+ROTATION_STEPS = 120
+ROTATION_CACHE_BUDGET = 32 * 1024 * 1024
+ROTATION_CACHE_EAGER = False
+ROTATION_CACHE_ATLAS = False
+
+# How the client talks to the server, either "binary" or "json" for debugging
+NETWORK_PROTOCOL = "binary"
+
+# How the server handles connections, either "threaded" (a thread per connection) or "asyncio" (one event loop)
+SERVER_MODE = "threaded"
+# How many snapshots can wait to be sent to a client before the oldest is dropped
+SEND_QUEUE_SIZE = 4
+
+# How many times a second the client sends its input to the server
+NETWORK_SEND_RATE = FPS
+# How many seconds the client waits for its network thread to finish when disconnecting
+NETWORK_STOP_TIMEOUT = 1
+
+# A headless server simulates this many fixed ticks a second, running at most MAX_CATCHUP_TICKS at once to catch up
+SERVER_TICK_RATE = FPS
+MAX_CATCHUP_TICKS = 5
+
+# Clients are only sent sprites within this many pixels of their player, which stay until they are a further
+# INTEREST_HYSTERESIS pixels away
+INTEREST_RADIUS = 1000
+INTEREST_HYSTERESIS = 200
+
+# The lobby runs each match in its own process, using a pool of this many worker processes (0 for one per core)
+MATCH_WORKERS = 0
+# How many players can join one match
+MATCH_PLAYERS = 8
+# How often in seconds each match reports its health to the lobby, and how far below SERVER_TICK_RATE it can fall
+# before the lobby stops sending it new players
+MATCH_HEALTH_INTERVAL = 1
+MATCH_MIN_TICK_RATE = SERVER_TICK_RATE * 0.9
+# How long in seconds after a match starts its tick rate is not held against it, while it loads and catches up
+MATCH_HEALTH_GRACE = MATCH_HEALTH_INTERVAL * 2
+
+# Guards cache at most this many paths between patrol points, counting each cell along a path
+PATH_CACHE_SIZE = 65536
+
+# How far in cells flow fields reach out from the player guards are chasing
+FLOW_FIELD_RANGE = 24
+
+# Room is made for this many bullets in flight at once, doubling whenever it runs out
+PROJECTILE_CAPACITY = 256
+BULLET_SPEED = 1000
+BULLET_DAMAGE = 25
+
+# The client keeps this many frames of timings for each part of a frame
+PROFILER_FRAMES = FPS * 5
+# Whether the timings are drawn over the game at the start, and how many frames the drawn text is reused for
+PROFILER_OVERLAY = False
+PROFILER_OVERLAY_PERIOD = FPS // 4
+PROFILER_OVERLAY_KEY = pygame.K_F3
+# Pressing this key runs cProfile for this many frames and saves what it found to the cache
+PROFILER_CAPTURE_KEY = pygame.K_F4
+PROFILER_CAPTURE_FRAMES = FPS * 5
+
+# The server serves its metrics for Prometheus at http://TELEMETRY_HOST:TELEMETRY_PORT/metrics, or not at all if the port is None.
+# Each match a lobby runs serves its own on the ports after it
+TELEMETRY_HOST = "127.0.0.1"
+TELEMETRY_PORT = 9100
+# The histogram buckets of tick times as fractions of the tick budget, and of serialization times and input latencies in seconds
+TELEMETRY_TICK_BUCKETS = [0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 4]
+TELEMETRY_SERIALIZATION_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025]
+TELEMETRY_LATENCY_BUCKETS = [0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1]
\ No newline at end of file
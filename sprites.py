@@ -4,9 +4,7 @@ from pygame import Vector2
 from math import cos, sin, atan2, pi
 
 from settings import *
-
-def collide_rect(player, wall):
-    return player.col_rect.colliderect(wall.rect)
+from playerLighting import obsticlesChanged
 
 def rotateVector2(vector2, angle) -> Vector2:
     vector2 = Vector2(vector2)
@@ -19,6 +17,101 @@ def rotateVector2(vector2, angle) -> Vector2:
 
     return vector2
 
+class SpatialHash:
+    """A uniform grid that buckets sprites by the cells their rect covers"""
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+
+        # Maps a cell to the sprites in it and a sprite to the cells it is in
+        self.cells = {}
+        self.spriteCells = {}
+
+        # Broadphase counters
+        self.queries = 0
+        self.candidatePairs = 0
+        self.bruteForcePairs = 0
+
+    def cellsForRect(self, rect) -> tuple:
+        """Return the range of cells a rect covers as (left, top, right, bottom)"""
+        return (
+            int(rect.left // self.cellSize),
+            int(rect.top // self.cellSize),
+            int((rect.right - 1) // self.cellSize),
+            int((rect.bottom - 1) // self.cellSize),
+        )
+
+    def insert(self, sprite, rect) -> None:
+        cellRange = self.cellsForRect(rect)
+        self.spriteCells[sprite] = cellRange
+
+        left, top, right, bottom = cellRange
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                self.cells.setdefault((x, y), {})[sprite] = None
+
+    def remove(self, sprite) -> None:
+        cellRange = self.spriteCells.pop(sprite, None)
+        if cellRange is None:
+            return
+
+        left, top, right, bottom = cellRange
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = self.cells[(x, y)]
+                del cell[sprite]
+                # Don't keep empty cells around
+                if not cell:
+                    del self.cells[(x, y)]
+
+    def move(self, sprite, rect) -> None:
+        """Re-bucket a sprite, only touching the cells if it has changed cell"""
+        if self.spriteCells.get(sprite) == self.cellsForRect(rect):
+            return
+
+        self.remove(sprite)
+        self.insert(sprite, rect)
+
+    def query(self, rect) -> list:
+        """Return every sprite sharing a cell with the rect"""
+        left, top, right, bottom = self.cellsForRect(rect)
+
+        # A dictionary is used so that sprites spanning several cells are only returned once, in a stable order
+        candidates = {}
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = self.cells.get((x, y))
+                if cell:
+                    candidates.update(cell)
+
+        self.queries += 1
+        self.candidatePairs += len(candidates)
+        self.bruteForcePairs += len(self.spriteCells)
+
+        return list(candidates)
+
+    def nearest(self, position, radius, predicate=None):
+        """Return the sprite with its rect center closest to position, within radius and matching predicate, or None"""
+        searchRect = pygame.Rect(position[0] - radius - 1, position[1] - radius - 1, radius * 2 + 2, radius * 2 + 2)
+
+        closest = None
+        closestDistance = radius * radius
+        for sprite in self.query(searchRect):
+            if predicate and not predicate(sprite):
+                continue
+
+            offsetX = sprite.rect.centerx - position[0]
+            offsetY = sprite.rect.centery - position[1]
+            distance = offsetX * offsetX + offsetY * offsetY
+            if distance < closestDistance or (not closest and distance == closestDistance):
+                closest = sprite
+                closestDistance = distance
+
+        return closest
+
+    def collide(self, rect, exclude=None) -> list:
+        """Return every sprite whose rect overlaps the rect"""
+        return [sprite for sprite in self.query(rect) if sprite is not exclude and rect.colliderect(sprite.rect)]
+
 class Character(pygame.sprite.Sprite):
     def __init__(self, game, position, characterImages, characterName):
         pygame.sprite.Sprite.__init__(self, game.all_sprites, game.all_characters)
@@ -47,6 +140,10 @@ class Character(pygame.sprite.Sprite):
 
         self.health = 100
 
+        self.networkId = next(game.networkIds)
+
+        game.characterGrid.insert(self, self.rect)
+
     def update(self):
         self.updateVelocity()
         self.velocity *= FLOOR_FRICTION
@@ -64,12 +161,18 @@ class Character(pygame.sprite.Sprite):
 
         self.rotate()
 
+        self.game.characterGrid.move(self, self.rect)
+
         if self.health <= 0:
             self.kill()
 
+    def kill(self):
+        self.game.characterGrid.remove(self)
+        super().kill()
+
     def wall_collision (self, direction):
         if direction == 'x':
-            hits = pygame.sprite.spritecollide(self, self.game.all_obsticles, False, collide_rect)
+            hits = self.game.obsticleGrid.collide(self.col_rect)
             # For every wall im colliding with
             for hit in hits:
                 # If im moving right
@@ -88,7 +191,7 @@ class Character(pygame.sprite.Sprite):
                 # Stop the loop
                 break
         elif direction == 'y':
-            hits = pygame.sprite.spritecollide(self, self.game.all_obsticles, False, collide_rect)
+            hits = self.game.obsticleGrid.collide(self.col_rect)
             for hit in hits:
                 if self.velocity.y > 0:
                     self.position.y = hit.rect.top - self.col_rect.height / 2
@@ -110,12 +213,12 @@ class Character(pygame.sprite.Sprite):
         if smoothing:
             self.angle = (self.angle + self.previousAngle*4) / 5
 
-        self.image = pygame.transform.rotate(self.characterImages[self.characterName][self.imageKey], self.angle)
+        self.image = self.game.rotationCache.get(f"{self.characterName}_{self.imageKey}", self.angle)
 
     def shoot(self):
-        if pygame.time.get_ticks() > self.lastFireTime + self.fireRate:
-            self.lastFireTime = pygame.time.get_ticks()
-            Bullet(self.game, self, self.position + rotateVector2(self.bulletOffset, -self.angle), self.angle, 400)
+        if self.game.time > self.lastFireTime + self.fireRate:
+            self.lastFireTime = self.game.time
+            self.game.projectiles.spawn(self, self.position + rotateVector2(self.bulletOffset, -self.angle), self.angle, 400)
 
     def getCharacterRotation(self):
         return atan2(-self.velocity.y, self.velocity.x) * 180/pi
@@ -169,15 +272,9 @@ class Player(Character):
         return False
 
     def pickupClosestObject(self) -> None:
-        # Get the closest object
-        closestObject = None
-        closestDistance = 0
-        for object in self.game.all_objects:
-            if not closestObject or (self.position - Vector2(object.rect.center)).magnitude() < closestDistance:
-                closestObject = object
-                closestDistance = (self.position - Vector2(object.rect.center)).magnitude()
-
-        if closestDistance > 40:
+        # Get the closest object within reach
+        closestObject = self.game.objectGrid.nearest(self.position, 40)
+        if not closestObject:
             return
 
         self.holdingObject = closestObject
@@ -234,21 +331,6 @@ class Guard(Character):
 
         self.game = game
 
-    def getClosestCharacterDistance(self) -> None or Vector2:
-        closestOffset = None
-        for character in self.game.all_characters:
-            if type(character) == Player:
-
-                # If the offset is closes, save it as the closest
-                offset = self.position - character.position
-                if not closestOffset or offset.magnitude() < closestOffset.magnitude():
-                    closestOffset = offset
-
-        if closestOffset and closestOffset.magnitude() > self.sightRange:
-            closestOffset = None
-
-        return closestOffset
-
     def updateVelocity(self):
         pointOffset = self.position - self.points[self.currentPoint]
 
@@ -260,14 +342,20 @@ class Guard(Character):
             # If the guard is at the end of the path, go back to the start
             self.currentPoint %= len(self.points)
 
-        nearestCharacter = self.getClosestCharacterDistance()
+        navigation = self.game.navigation
 
-        # Change the image and chase player if near enough to one
-        self.imageKey = "stand"
+        # The closest player the guard can see, found for every guard at once at the start of the tick
+        nearestCharacter = self.game.perception.returnTargetPlayer(self)
+
+        # Change the image and chase player if near enough to one, following the flow field shared by every guard chasing them
         if nearestCharacter:
-            pointOffset = nearestCharacter
+            pointOffset = self.position - Vector2(navigation.returnFlowWaypoint(self.position, nearestCharacter))
             self.imageKey = "gun"
             self.shoot()
+        else:
+            # Follow the path around the walls to the current point
+            pointOffset = self.position - Vector2(navigation.returnPathWaypoint(self.position, self.points[self.currentPoint]))
+            self.imageKey = "stand"
 
         # Allow even a vector of (0, 0) to be normalised
         if pointOffset.magnitude() == 0:
@@ -280,6 +368,10 @@ class Obsticle(pygame.sprite.Sprite):
         pygame.sprite.Sprite.__init__(self, [game.all_sprites, game.all_obsticles])
         self.rect = pygame.Rect(position[0], position[1], size[0], size[1])
 
+        self.game = game
+        game.obsticleGrid.insert(self, self.rect)
+        obsticlesChanged()
+
         self.size = Vector2(size)
         self.position = Vector2(position)
         self.centerPosition = Vector2(position) + Vector2(size)/2
@@ -304,6 +396,11 @@ class Obsticle(pygame.sprite.Sprite):
             Obsticle(game, (self.position.x, self.position.y + self.size.y/2), (self.size.x, self.size.y/2), self.isTransparent)
             self.kill()
 
+    def kill(self):
+        self.game.obsticleGrid.remove(self)
+        super().kill()
+        obsticlesChanged()
+
     def returnShaddowPolygons(self, lightPos, lightRange):
         """Returns the polygons of shaddows from a light source"""
 
@@ -354,6 +451,8 @@ class Object(pygame.sprite.Sprite):
     def __init__(self, game, position, angle, image, imageName):
         pygame.sprite.Sprite.__init__(self, [game.all_sprites, game.all_objects])
 
+        self.game = game
+
         self.position = Vector2(position)
         self.angle = angle
 
@@ -368,10 +467,12 @@ class Object(pygame.sprite.Sprite):
 
         self.heldBy = None
 
-        self.game = game
+        self.networkId = next(game.networkIds)
+
+        game.objectGrid.insert(self, self.rect)
 
     def generateImage(self):
-        self.image = pygame.transform.rotate(self.originalImage, self.angle)
+        self.image = self.game.rotationCache.get(self.originalImageName, self.angle)
         self.rect = self.image.get_rect()
         self.rect.center = self.position
 
@@ -385,6 +486,12 @@ class Object(pygame.sprite.Sprite):
 
         self.rect.center = self.position
 
+        self.game.objectGrid.move(self, self.rect)
+
+    def kill(self):
+        self.game.objectGrid.remove(self)
+        super().kill()
+
     def pickup(self, character):
         self.heldBy = character
 
@@ -399,65 +506,15 @@ class Object(pygame.sprite.Sprite):
 
         # If near a bag, be put inside of it
         if type(self) != Bag:
-            closestBag = None
-            closestDistance = 999
-
-            for sprite in self.game.all_sprites:
-                if type(sprite) == Bag:
-                    if not sprite.isFull():
-                        distance = Vector2.magnitude(self.position - sprite.position)
-                        if distance < closestDistance:
-                            closestDistance = distance
-                            closestBag = sprite
-
-            if closestDistance < 50:
+            closestBag = self.game.objectGrid.nearest(self.position, 50, lambda sprite: type(sprite) == Bag and not sprite.isFull())
+
+            if closestBag:
                 self.image = pygame.Surface(self.originalImage.get_size())
                 self.pickup(closestBag)
                 closestBag.itemsHeld.append(self)
 
                 self.imageName = "None"
 
-class Bullet(pygame.sprite.Sprite):
-    def __init__(self, game, parent, startPos, angle, range):
-        pygame.sprite.Sprite.__init__(self, [game.all_sprites, game.all_projectiles])
-
-        self.game = game
-        self.parent = parent
-        self.startPos = startPos
-        self.position = Vector2(startPos)
-        self.direction = rotateVector2(Vector2(0, 1), -angle - 90)
-        self.range = range
-
-        self.angle = angle
-        self.imageName = "bullet"
-
-        self.image = game.spriteImgs["bullet"]
-        self.rect = self.image.get_rect()
-        self.rect.center = self.startPos
-
-        self.speed = 1000
-
-    def update(self):
-        self.position += self.direction * self.speed * self.game.deltaT
-
-        self.rect.center = self.position
-
-        # Kill if touching a wall
-        hits = pygame.sprite.spritecollide(self, self.game.all_obsticles, False)
-        if hits:
-            self.kill()
-
-        # Do damage to characters
-        hits = pygame.sprite.spritecollide(self, self.game.all_characters, False)
-        for hit in hits:
-            if hit != self.parent:
-                hit.health -= 25
-                self.kill()
-                break
-
-        if (self.position - self.startPos).magnitude() >= self.range:
-            self.kill()
-
 class Bag(Object):
     def __init__(self, game, position, angle):
         super().__init__(game, position, angle, game.spriteImgs["bag"], "bag")
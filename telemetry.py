@@ -0,0 +1,220 @@
+import threading
+
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from settings import *
+
+# Every metric's name starts with this so they don't clash with other exporters on the same host
+METRIC_PREFIX = "stealth_"
+
+class Histogram:
+    """Counts of values falling under each bucket's upper bound, as Prometheus histograms are exposed"""
+    def __init__(self, bounds):
+        self.bounds = sorted(bounds)
+        # The last count is for values over every bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+        # Connections record from their own threads in the threaded server
+        self.lock = threading.Lock()
+
+    def observe(self, value) -> None:
+        with self.lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def returnLines(self, name, labels="") -> list:
+        """Return the histogram's lines in the Prometheus text format"""
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        separator = "," if labels else ""
+
+        lines = []
+        cumulative = 0
+        for bound, bucketCount in zip(self.bounds + ["+Inf"], counts):
+            cumulative += bucketCount
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{labels} {total}")
+        lines.append(f"{name}_count{labels} {count}")
+
+        return lines
+
+class ConnectionStats:
+    """The bytes and messages sent and received over one connection"""
+    def __init__(self, address):
+        self.address = address
+
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.messagesIn = 0
+        self.messagesOut = 0
+
+    def addReceived(self, size) -> None:
+        self.bytesIn += size
+        self.messagesIn += 1
+
+    def addSent(self, size) -> None:
+        self.bytesOut += size
+        self.messagesOut += 1
+
+class InputLatency:
+    """Measures how long it takes an input to show up in a snapshot sent back to the client that sent it"""
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+        # The time the oldest input not yet in a sent snapshot arrived, and the tick it arrived during
+        self.inputTime = None
+        self.inputTick = None
+
+    def addInput(self, tick, time) -> None:
+        if self.inputTime is None:
+            self.inputTime = time
+            self.inputTick = tick
+
+    def addSnapshot(self, tick, time) -> None:
+        # The input is only applied by the first tick finished after it arrived
+        if self.inputTime is not None and tick > self.inputTick:
+            self.histogram.observe(time - self.inputTime)
+            self.inputTime = None
+
+class Telemetry:
+    """How the server is performing, collected as it runs and read as Prometheus metrics"""
+    def __init__(self, tickBudget=1/SERVER_TICK_RATE):
+        self.tickBudget = tickBudget
+
+        self.tickTimes = Histogram([tickBudget * fraction for fraction in TELEMETRY_TICK_BUCKETS])
+        self.tickOverruns = 0
+        # Ticks that were never run because the game fell too far behind to catch up
+        self.skippedTicks = 0
+
+        self.serializationTimes = Histogram(TELEMETRY_SERIALIZATION_BUCKETS)
+        self.inputLatencies = Histogram(TELEMETRY_LATENCY_BUCKETS)
+
+        # The stats of every open connection by its address, and how many connections there have been
+        self.connections = {}
+        self.connectionCount = 0
+        self.lock = threading.Lock()
+
+    def recordTick(self, seconds) -> None:
+        self.tickTimes.observe(seconds)
+        if seconds > self.tickBudget:
+            self.tickOverruns += 1
+
+    def recordSkippedTicks(self, ticks) -> None:
+        self.skippedTicks += ticks
+
+    def recordSerialization(self, seconds) -> None:
+        self.serializationTimes.observe(seconds)
+
+    def addConnection(self, address) -> ConnectionStats:
+        """Start counting the traffic of a connection"""
+        stats = ConnectionStats(f"{address[0]}:{address[1]}")
+        with self.lock:
+            self.connections[stats.address] = stats
+            self.connectionCount += 1
+
+        return stats
+
+    def removeConnection(self, stats) -> None:
+        with self.lock:
+            self.connections.pop(stats.address, None)
+
+    def returnInputLatency(self) -> InputLatency:
+        """Return a tracker of one connection's input latency"""
+        return InputLatency(self.inputLatencies)
+
+    def returnMetricsText(self, entityCounts, broadphaseStats) -> str:
+        """Return every metric in the Prometheus text format"""
+        lines = []
+
+        def addMetric(name, kind, description, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+            lines.extend(samples)
+
+        addMetric("tick_seconds", "histogram", "Time taken to run each game tick.", self.tickTimes.returnLines(METRIC_PREFIX + "tick_seconds"))
+        addMetric("tick_budget_seconds", "gauge", "Time each tick has to run in to keep up.", [f"{METRIC_PREFIX}tick_budget_seconds {self.tickBudget}"])
+        addMetric("tick_overruns_total", "counter", "Ticks that took longer than the tick budget.", [f"{METRIC_PREFIX}tick_overruns_total {self.tickOverruns}"])
+        addMetric("ticks_skipped_total", "counter", "Ticks dropped because the game fell too far behind.", [f"{METRIC_PREFIX}ticks_skipped_total {self.skippedTicks}"])
+
+        addMetric("entities", "gauge", "Entities in each sprite group.", [f'{METRIC_PREFIX}entities{{group="{group}"}} {count}' for group, count in entityCounts.items()])
+
+        # The counters start again with each new game, which Prometheus treats as a counter reset
+        for name, key, description in [
+            ("broadphase_queries_total", "queries", "Spatial hash queries made by each grid."),
+            ("broadphase_candidates_total", "candidatePairs", "Candidate pairs the spatial hash queries of each grid returned."),
+            ("broadphase_brute_force_candidates_total", "bruteForcePairs", "Pairs the same queries would have checked scanning every sprite in the grid."),
+        ]:
+            addMetric(name, "counter", description, [f'{METRIC_PREFIX}{name}{{grid="{grid}"}} {stats[key]}' for grid, stats in broadphaseStats.items()])
+
+        addMetric("serialization_seconds", "histogram", "Time taken to build and encode a snapshot for a client.", self.serializationTimes.returnLines(METRIC_PREFIX + "serialization_seconds"))
+        addMetric("input_latency_seconds", "histogram", "Time from an input arriving to the first snapshot sent after it was applied.", self.inputLatencies.returnLines(METRIC_PREFIX + "input_latency_seconds"))
+
+        with self.lock:
+            connections = list(self.connections.values())
+            connectionCount = self.connectionCount
+
+        addMetric("connections", "gauge", "Open client connections.", [f"{METRIC_PREFIX}connections {len(connections)}"])
+        addMetric("connections_total", "counter", "Client connections accepted.", [f"{METRIC_PREFIX}connections_total {connectionCount}"])
+        addMetric("connection_bytes_total", "counter", "Bytes sent and received over each open connection.", [
+            f'{METRIC_PREFIX}connection_bytes_total{{connection="{stats.address}",direction="{direction}"}} {size}'
+            for stats in connections for direction, size in (("in", stats.bytesIn), ("out", stats.bytesOut))
+        ])
+        addMetric("connection_messages_total", "counter", "Messages sent and received over each open connection.", [
+            f'{METRIC_PREFIX}connection_messages_total{{connection="{stats.address}",direction="{direction}"}} {count}'
+            for stats in connections for direction, count in (("in", stats.messagesIn), ("out", stats.messagesOut))
+        ])
+
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves a game's telemetry over HTTP for Prometheus to scrape, on a background thread"""
+    def __init__(self, game, host=TELEMETRY_HOST, port=TELEMETRY_PORT):
+        self.game = game
+
+        metricsServer = self
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metricsServer.returnMetricsText().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Don't print a line for every scrape
+                pass
+
+        # Run without metrics rather than not at all if the port is taken, such as by another server on the host
+        try:
+            self.httpServer = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as error:
+            print(f"Could not serve metrics on {host}:{port}, running without them: {error}")
+            self.httpServer = None
+            return
+
+        self.httpServer.daemon_threads = True
+        threading.Thread(target=self.httpServer.serve_forever, daemon=True).start()
+
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def returnMetricsText(self) -> str:
+        return self.game.telemetry.returnMetricsText(self.game.returnEntityCounts(), self.game.getBroadphaseStats())
+
+    def stop(self) -> None:
+        if self.httpServer is None:
+            return
+
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
\ No newline at end of file
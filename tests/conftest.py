@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The tests never draw, so use SDL's dummy drivers
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# The game's modules are imported from the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
\ No newline at end of file
@@ -0,0 +1,97 @@
+import random
+import pygame
+import numpy as np
+
+from types import SimpleNamespace
+
+from settings import *
+from sprites import SpatialHash, Obsticle
+from playerLighting import returnSweepSight, returnShaddowSight, returnNumpySight
+
+SIGHT_RANGE = 400
+
+def returnObsticles(rng, count, spread=500):
+    """Return a group of obsticles of random sizes around the origin, many of them overlapping"""
+    game = SimpleNamespace(all_sprites=pygame.sprite.Group(), all_obsticles=pygame.sprite.Group(), obsticleGrid=SpatialHash(GRID_CELL_SIZE), sightRange=SIGHT_RANGE)
+    for _ in range(count):
+        Obsticle(game, (rng.uniform(-spread, spread), rng.uniform(-spread, spread)), (rng.choice([32, 64, 128]), rng.choice([32, 64, 128])), False)
+
+    return game.all_obsticles
+
+def returnLightPositions(rng, obsticles, count) -> list:
+    """Return light positions that aren't inside an obsticle"""
+    positions = []
+    while len(positions) < count:
+        position = pygame.Vector2(rng.uniform(-300, 300), rng.uniform(-300, 300))
+        if not any(obsticle.rect.collidepoint(position) for obsticle in obsticles):
+            positions.append(position)
+
+    return positions
+
+def returnLitPixels(light) -> np.ndarray:
+    return pygame.surfarray.array3d(light)[:, :, 0] > 0
+
+def returnSettledPixels(lit) -> np.ndarray:
+    """Return which pixels are lit the same as every pixel around them, so aren't on the edge of a polygon"""
+    padded = np.pad(lit, 1, mode="edge")
+    settled = np.ones_like(lit)
+    for x in range(3):
+        for y in range(3):
+            settled &= padded[x:x + lit.shape[0], y:y + lit.shape[1]] == lit
+
+    return settled
+
+def returnVisiblePixels(lightPos, obsticles, pixels) -> np.ndarray:
+    """Return whether the line from the light to the center of each pixel misses the inside of every obsticle"""
+    ends = pixels + 0.5 - SIGHT_RANGE
+    left, top, right, bottom = np.array([
+        (obsticle.position.x - lightPos.x, obsticle.position.y - lightPos.y, obsticle.position.x + obsticle.size.x - lightPos.x, obsticle.position.y + obsticle.size.y - lightPos.y)
+        for obsticle in obsticles
+    ]).T
+
+    # When along the line it enters and leaves each obsticle, as a fraction of its length
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xTimes = np.stack((left / ends[:, None, 0], right / ends[:, None, 0]))
+        yTimes = np.stack((top / ends[:, None, 1], bottom / ends[:, None, 1]))
+    enter = np.maximum(xTimes.min(axis=0), yTimes.min(axis=0))
+    leave = np.minimum(xTimes.max(axis=0), yTimes.max(axis=0))
+
+    return ~((enter < leave) & (leave > 0) & (enter < 1)).any(axis=1)
+
+def test_sweepMatchesLineOfSight():
+    rng = random.Random(1)
+    pixelRng = np.random.default_rng(1)
+    obsticles = returnObsticles(rng, 200)
+
+    for lightPos in returnLightPositions(rng, obsticles, 10):
+        lit = returnLitPixels(returnSweepSight(lightPos, obsticles, SIGHT_RANGE, WHITE))
+
+        pixels = pixelRng.integers(0, 2 * SIGHT_RANGE, (4000, 2))
+        pixels = pixels[returnSettledPixels(lit)[pixels[:, 0], pixels[:, 1]]]
+
+        assert (lit[pixels[:, 0], pixels[:, 1]] == returnVisiblePixels(lightPos, obsticles, pixels)).all()
+
+def test_sweepInsideObsticle():
+    rng = random.Random(2)
+    obsticles = returnObsticles(rng, 40)
+    obsticle = next(iter(obsticles))
+
+    # Only the inside of the obsticle can be seen from inside it
+    lightPos = obsticle.position + obsticle.size / 2
+    lit = returnLitPixels(returnSweepSight(lightPos, obsticles, SIGHT_RANGE, WHITE))
+
+    xs, ys = np.nonzero(lit)
+    assert len(xs)
+    assert xs.min() >= obsticle.position.x - lightPos.x + SIGHT_RANGE - 1
+    assert xs.max() <= obsticle.position.x + obsticle.size.x - lightPos.x + SIGHT_RANGE
+    assert ys.min() >= obsticle.position.y - lightPos.y + SIGHT_RANGE - 1
+    assert ys.max() <= obsticle.position.y + obsticle.size.y - lightPos.y + SIGHT_RANGE
+
+def test_numpyMatchesShaddows():
+    rng = random.Random(3)
+    obsticles = returnObsticles(rng, 200)
+
+    # The batched shaddows are drawn pixel for pixel the same as the ones made an obsticle at a time
+    for lightPos in returnLightPositions(rng, obsticles, 10) + [next(iter(obsticles)).centerPosition]:
+        shaddows = returnLitPixels(returnShaddowSight(lightPos, obsticles, SIGHT_RANGE, WHITE))
+        assert (returnLitPixels(returnNumpySight(lightPos, obsticles, SIGHT_RANGE, WHITE)) == shaddows).all()
\ No newline at end of file
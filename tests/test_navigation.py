@@ -0,0 +1,127 @@
+import random
+import pytest
+
+from math import sqrt, isclose
+from heapq import heappush, heappop
+from types import SimpleNamespace
+
+from navigation import NavigationGrid, FlowField
+
+CELL_SIZE = 32
+
+def returnGrid(rng, columns=24, rows=18, wallChance=0.3) -> NavigationGrid:
+    """Return a navigation grid of a map with a solid object over random cells"""
+    objects = [SimpleNamespace(name="solid", x=x * CELL_SIZE, y=y * CELL_SIZE, width=CELL_SIZE, height=CELL_SIZE) for y in range(rows) for x in range(columns) if rng.random() < wallChance]
+    tmxdata = SimpleNamespace(width=columns, height=rows, visible_layers=[], objects=objects, get_tile_properties_by_gid=lambda gid: None)
+
+    return NavigationGrid(SimpleNamespace(tileWidth=CELL_SIZE, tileHeight=CELL_SIZE, tmxdata=tmxdata, scale=1))
+
+def returnDistances(grid, source) -> dict:
+    """Return the cost of the shortest path from source to every cell it can reach, found by brute force Dijkstra on the blocked array"""
+    rows, columns = grid.blocked.shape
+
+    def isOpen(x, y):
+        return 0 <= x < columns and 0 <= y < rows and not grid.blocked[y, x]
+
+    distances = {source: 0}
+    queue = [(0, source)]
+    while queue:
+        distance, (x, y) = heappop(queue)
+        if distance > distances[(x, y)]:
+            continue
+
+        for stepX in (-1, 0, 1):
+            for stepY in (-1, 0, 1):
+                if not (stepX or stepY) or not isOpen(x + stepX, y + stepY):
+                    continue
+                if stepX and stepY and not (isOpen(x + stepX, y) and isOpen(x, y + stepY)):
+                    continue
+
+                cost = distance + (sqrt(2) if stepX and stepY else 1)
+                if cost < distances.get((x + stepX, y + stepY), float("inf")) - 1e-9:
+                    distances[(x + stepX, y + stepY)] = cost
+                    heappush(queue, (cost, (x + stepX, y + stepY)))
+
+    return distances
+
+def returnPathCost(grid, path) -> float:
+    """Return the cost of walking a path, checking every step is allowed"""
+    cost = 0
+    for cell, nextCell in zip(path, path[1:]):
+        steps = dict(grid.returnNeighbours(cell))
+        assert nextCell in steps
+        cost += steps[nextCell]
+
+    return cost
+
+def returnOpenCells(grid) -> list:
+    return [cell for cell in grid.neighbours if grid.isWalkable(cell)]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pathIsShortest(seed):
+    rng = random.Random(seed)
+    grid = returnGrid(rng)
+    cells = returnOpenCells(grid)
+
+    for _ in range(20):
+        start, goal = rng.sample(cells, 2)
+        distances = returnDistances(grid, start)
+
+        path, index = grid.findPath(start, goal)
+        if goal not in distances:
+            assert path is None
+            continue
+
+        assert index == 0 and path[0] == start and path[-1] == goal
+        assert isclose(returnPathCost(grid, path), distances[goal])
+
+def test_unreachableGoal():
+    grid = returnGrid(random.Random(0), wallChance=0)
+
+    # Wall off the top left corner
+    grid.blocked[:3, 3] = grid.blocked[3, :4] = True
+    grid.walkable = (~grid.blocked).tolist()
+    grid.neighbours = {cell: grid.findNeighbours(cell) for cell in grid.neighbours}
+    grid.regions = grid.findRegions()
+
+    assert grid.findPath((10, 10), (1, 1)) == (None, 0)
+    assert grid.findPath((10, 10), (3, 0)) == (None, 0)
+    assert grid.returnPathWaypoint((330, 330), (40, 40)) == (40, 40)
+
+def test_cachedSuffixPaths():
+    grid = returnGrid(random.Random(1), wallChance=0.2)
+    cells = returnOpenCells(grid)
+    start, goal = max(((start, goal) for start in cells[:5] for goal in cells[-5:]), key=lambda pair: len(grid.searchPath(*pair) or ()))
+
+    path, _ = grid.findPath(start, goal)
+    assert len(path) > 3
+
+    # Every later cell of the path reads the same path from the cache, starting where it is along it
+    for i, cell in enumerate(path[:-1]):
+        hits = grid.pathHits
+        assert grid.findPath(cell, goal) == (path, i)
+        assert grid.findPath(cell, goal)[0] is path
+        assert grid.pathHits == hits + 2
+
+        assert grid.returnPathWaypoint(grid.returnCellCenter(cell), grid.returnCellCenter(goal)) == grid.returnCellCenter(path[i + 1])
+
+@pytest.mark.parametrize("seed", range(3))
+def test_flowFieldFollowsShortestPaths(seed):
+    rng = random.Random(seed)
+    grid = returnGrid(rng)
+    target = rng.choice(returnOpenCells(grid))
+
+    maxCost = 12
+    flowField = FlowField(grid, target, maxCost)
+    distances = returnDistances(grid, target)
+
+    # The field reaches exactly the cells within maxCost of the target, and following it from one is a shortest path back
+    assert set(flowField.nextCells) == {cell for cell, distance in distances.items() if distance <= maxCost + 1e-9}
+    for cell in flowField.nextCells:
+        path = [cell]
+        while path[-1] != target:
+            path.append(flowField.returnNextCell(path[-1]))
+
+        assert isclose(returnPathCost(grid, path), distances[cell], abs_tol=1e-9)
+
+    assert flowField.returnNextCell((-1, -1)) is None
\ No newline at end of file
@@ -0,0 +1,70 @@
+import socket
+import pytest
+
+from protocol import *
+
+KEYS = [[[100.5, -20.25], [1, 0, 1]], [1, 0], [0, 1], [0, 0], [1, 1], 0, 1, 0, 1]
+
+def returnSnapshot(keyframe) -> dict:
+    return {
+        "keyframe": keyframe,
+        "sequence": 7,
+        "base": 0 if keyframe else 6,
+        "spawned": [[1, 1, IMAGE_NAMES[1], -5, 10, 0], [2, 0, IMAGE_NAMES[-1], 300, 400, 65535]],
+        "despawned": [] if keyframe else [3, 4],
+        "changed": [] if keyframe else [[5, [[0, 1], [1, IMAGE_NAMES[2]], [4, 1000]]], [6, [[2, -7], [3, 8]]]],
+    }
+
+@pytest.mark.parametrize("mode", [MODE_BINARY, MODE_JSON])
+def test_inputRoundTrip(mode):
+    assert readInput(makeInput(KEYS, 12345, mode), mode) == (KEYS, 12345)
+
+@pytest.mark.parametrize("mode", [MODE_BINARY, MODE_JSON])
+@pytest.mark.parametrize("keyframe", [True, False])
+def test_snapshotRoundTrip(mode, keyframe):
+    snapshot = returnSnapshot(keyframe)
+    assert readSnapshot(makeSnapshotPayload(snapshot, mode), mode) == snapshot
+
+def test_packedEntitiesAreReused():
+    snapshot = returnSnapshot(True)
+
+    # Entities without focus are taken from the packed ones, the focus is always packed again
+    packedEntities = {entityId: packEntity(entityId, 0, *entity) for entityId, _, *entity in snapshot["spawned"]}
+    assert makeSnapshotPayload(snapshot, MODE_BINARY, packedEntities) == makeSnapshotPayload(snapshot, MODE_BINARY)
+
+def test_malformedSnapshot():
+    payload = makeSnapshotPayload(returnSnapshot(False), MODE_BINARY)
+
+    with pytest.raises(ProtocolError):
+        readSnapshot(payload[:-1], MODE_BINARY)
+
+def test_hello():
+    assert readHello(makeHello(MODE_JSON)) == MODE_JSON
+
+    with pytest.raises(ProtocolError):
+        readHello(HELLO.pack(HELLO_MAGIC, PROTOCOL_VERSION + 1, MODE_BINARY))
+    with pytest.raises(ProtocolError):
+        readHello(HELLO.pack(HELLO_MAGIC, PROTOCOL_VERSION, 99))
+
+def test_frameTooLarge():
+    with pytest.raises(ProtocolError):
+        readFrameSize(FRAME_HEADER.pack(MAX_FRAME_SIZE + 1))
+
+def test_connectionFrames():
+    left, right = socket.socketpair()
+    sender, receiver = Connection(left), Connection(right)
+
+    try:
+        # Frames larger than the receive buffer make it grow, and frames arrive whole and in order
+        payloads = [b"", b"small", bytes(range(256)) * 100, b"after"]
+        for payload in payloads:
+            sender.sendFrame(payload)
+
+        for payload in payloads:
+            assert bytes(receiver.recvFrame()) == payload
+
+        sender.close()
+        with pytest.raises(ConnectionError):
+            receiver.recvFrame()
+    finally:
+        receiver.close()
\ No newline at end of file
@@ -0,0 +1,91 @@
+import random
+
+from protocol import *
+
+def returnChangedWorld(rng, world, nextId) -> tuple:
+    """Return a copy of a world of entity states with some entities spawned, despawned and changed, and the next free id"""
+    world = dict(world)
+
+    for entityId in rng.sample(sorted(world), min(len(world), rng.randint(0, 3))):
+        del world[entityId]
+
+    for entityId in rng.sample(sorted(world), min(len(world), rng.randint(0, 10))):
+        focus, image, x, y, angle = world[entityId]
+        world[entityId] = (focus, image, x + rng.randint(-5, 5), y + rng.randint(-5, 5), rng.choice([angle, rng.randint(0, 65535)]))
+
+    for _ in range(rng.randint(0, 3)):
+        world[nextId] = (0, rng.choice(IMAGE_NAMES[1:]), rng.randint(-1000, 1000), rng.randint(-1000, 1000), rng.randint(0, 65535))
+        nextId += 1
+
+    return world, nextId
+
+def returnDecoded(snapshot) -> dict:
+    """Send a snapshot through the binary protocol"""
+    return readSnapshot(makeSnapshotPayload(snapshot, MODE_BINARY), MODE_BINARY)
+
+def test_deltasRebuildTheWorld():
+    rng = random.Random(1)
+    encoder, decoder = SnapshotEncoder(), SnapshotDecoder()
+
+    world, nextId = returnChangedWorld(rng, {}, 1)
+    for _ in range(200):
+        snapshot = encoder.makeSnapshotFromState(world, decoder.sequence)
+        decoder.apply(returnDecoded(snapshot))
+
+        assert {entityId: tuple(entity) for entityId, entity in decoder.entities.items()} == world
+        world, nextId = returnChangedWorld(rng, world, nextId)
+
+    # Only the first snapshot needed to be a keyframe
+    assert not snapshot["keyframe"]
+
+def test_lostSnapshots():
+    rng = random.Random(2)
+    encoder, decoder = SnapshotEncoder(), SnapshotDecoder()
+
+    world, nextId = returnChangedWorld(rng, {}, 1)
+    for _ in range(200):
+        snapshot = encoder.makeSnapshotFromState(world, decoder.sequence)
+
+        # Snapshots that never arrive leave the client acknowledging an older one, which later deltas are made from
+        if rng.random() < 0.3:
+            world, nextId = returnChangedWorld(rng, world, nextId)
+            continue
+
+        decoder.apply(returnDecoded(snapshot))
+        assert {entityId: tuple(entity) for entityId, entity in decoder.entities.items()} == world
+        world, nextId = returnChangedWorld(rng, world, nextId)
+
+def test_forgottenAckSendsKeyframe():
+    encoder = SnapshotEncoder()
+    world = {1: (1, IMAGE_NAMES[1], 0, 0, 0)}
+
+    encoder.makeSnapshotFromState(world, 0)
+    for _ in range(SNAPSHOT_HISTORY):
+        encoder.makeSnapshotFromState(world, encoder.sequence)
+
+    # The first snapshot has dropped out of the history, so a delta can't be made from it
+    snapshot = encoder.makeSnapshotFromState(world, 1)
+    assert snapshot["keyframe"]
+    assert snapshot["spawned"] == [[1, 1, IMAGE_NAMES[1], 0, 0, 0]]
+
+def test_deltaFromWrongBaseIgnored():
+    encoder, decoder = SnapshotEncoder(), SnapshotDecoder()
+
+    decoder.apply(encoder.makeSnapshotFromState({1: (0, IMAGE_NAMES[1], 0, 0, 0)}, 0))
+    second = encoder.makeSnapshotFromState({1: (0, IMAGE_NAMES[1], 5, 0, 0)}, decoder.sequence)
+    third = encoder.makeSnapshotFromState({1: (0, IMAGE_NAMES[1], 9, 0, 0)}, second["sequence"])
+
+    # The third snapshot was made from the second, which never arrived, so it is dropped until the next keyframe
+    decoder.apply(third)
+    assert decoder.entities == {1: [0, IMAGE_NAMES[1], 0, 0, 0]}
+    assert decoder.sequence == 1
+
+def test_unchangedEntitiesNotSent():
+    encoder = SnapshotEncoder()
+    world = {1: (0, IMAGE_NAMES[1], 0, 0, 0), 2: (0, IMAGE_NAMES[2], 10, 10, 0)}
+
+    encoder.makeSnapshotFromState(world, 0)
+    snapshot = encoder.makeSnapshotFromState({**world, 2: (0, IMAGE_NAMES[2], 11, 10, 0)}, 1)
+
+    assert snapshot["spawned"] == [] and snapshot["despawned"] == []
+    assert snapshot["changed"] == [[2, [[2, 11]]]]
\ No newline at end of file
@@ -0,0 +1,80 @@
+import random
+import pygame
+
+from sprites import SpatialHash
+
+class Box(pygame.sprite.Sprite):
+    def __init__(self, rect):
+        pygame.sprite.Sprite.__init__(self)
+        self.rect = rect
+
+def returnRandomRect(rng) -> pygame.Rect:
+    return pygame.Rect(rng.randint(-300, 1000), rng.randint(-300, 1000), rng.randint(1, 200), rng.randint(1, 200))
+
+def returnFilledHash(rng, count=200):
+    grid = SpatialHash(64)
+    boxes = [Box(returnRandomRect(rng)) for _ in range(count)]
+    for box in boxes:
+        grid.insert(box, box.rect)
+
+    return grid, boxes
+
+def test_collideMatchesBruteForce():
+    rng = random.Random(1)
+    grid, boxes = returnFilledHash(rng)
+
+    for _ in range(200):
+        rect = returnRandomRect(rng)
+        assert set(grid.collide(rect)) == {box for box in boxes if rect.colliderect(box.rect)}
+
+def test_collideAfterMovesAndRemoves():
+    rng = random.Random(2)
+    grid, boxes = returnFilledHash(rng)
+
+    for box in boxes[:100]:
+        box.rect = returnRandomRect(rng)
+        grid.move(box, box.rect)
+    for box in boxes[100:150]:
+        grid.remove(box)
+    boxes = boxes[:100] + boxes[150:]
+
+    for _ in range(200):
+        rect = returnRandomRect(rng)
+        assert set(grid.collide(rect)) == {box for box in boxes if rect.colliderect(box.rect)}
+
+    # Removing every sprite leaves no empty cells behind
+    for box in boxes:
+        grid.remove(box)
+    assert not grid.cells and not grid.spriteCells
+
+def test_queryReturnsEachSpriteOnce():
+    rng = random.Random(3)
+    grid, boxes = returnFilledHash(rng)
+
+    candidates = grid.query(pygame.Rect(-300, -300, 1500, 1500))
+    assert len(candidates) == len(set(candidates)) == len(boxes)
+
+def test_exclude():
+    grid = SpatialHash(64)
+    box = Box(pygame.Rect(0, 0, 10, 10))
+    grid.insert(box, box.rect)
+
+    assert grid.collide(box.rect) == [box]
+    assert grid.collide(box.rect, exclude=box) == []
+
+def test_nearestMatchesBruteForce():
+    rng = random.Random(4)
+    grid, boxes = returnFilledHash(rng)
+
+    for _ in range(200):
+        position = (rng.randint(-300, 1000), rng.randint(-300, 1000))
+        radius = rng.randint(1, 300)
+
+        distances = [(box.rect.centerx - position[0]) ** 2 + (box.rect.centery - position[1]) ** 2 for box in boxes]
+        inRange = [distance for distance in distances if distance <= radius * radius]
+
+        nearest = grid.nearest(position, radius)
+        if not inRange:
+            assert nearest is None
+        else:
+            assert distances[boxes.index(nearest)] == min(inRange)
\ No newline at end of file
@@ -1,86 +1,374 @@
+import os
 from math import sqrt
 import pygame
 from pygame import Vector2
+import numpy as np
 
 import pytmx
 
+from os import path, makedirs
+from collections import OrderedDict
+from hashlib import sha1
+from xml.etree import ElementTree
+
 from settings import *
 
 def returnFadeSurface(size):
     """Return a circular fade of size: size x size"""
-    # Create the surface onto which the fade will be drawn
-    fade = pygame.Surface((size, size))
+    # Load the fade from the disk if it has been made before
+    cachePath = path.join(CACHE_DIRECTORY, f"fade_{size}.npy")
+    try:
+        brightness = np.load(cachePath)
+    except (OSError, ValueError, EOFError):
+        brightness = generateFadeArray(size)
 
-    # For every pixel on the surface
-    for y in range(size):
-        for x in range(size):
-            # Calculate the distance to the center of the surface
-            distanceToCenter = sqrt((x - size/2) ** 2 + (y - size/2) ** 2)
-            # Turn it into a fraction from 0 up, invert it and set the values lower than 0 to 0. Multiply this by 255 to get a value from 0 to 255
-            brightness = max(1 - (distanceToCenter / (size/2)), 0) * 255
-            # Set that pixel to that brightness
-            fade.set_at((x, y), (brightness, brightness, brightness))
+        # Write to a temporary file first so a process dying part way through never leaves half a fade
+        makedirs(CACHE_DIRECTORY, exist_ok=True)
+        with open(cachePath + ".tmp", "wb") as f:
+            np.save(f, brightness)
+        os.replace(cachePath + ".tmp", cachePath)
+
+    # Create the surface onto which the fade will be drawn and copy the brightness into every colour channel
+    fade = pygame.Surface((size, size))
+    pygame.surfarray.blit_array(fade, np.repeat(brightness[:, :, None], 3, axis=2))
 
     return fade
 
+def generateFadeArray(size) -> np.ndarray:
+    """Return the brightness of every pixel of a circular fade, indexed by [x, y]"""
+    # Calculate the distance of every pixel to the center of the surface
+    x, y = np.ogrid[:size, :size]
+    distanceToCenter = np.sqrt((x - size/2) ** 2 + (y - size/2) ** 2)
+
+    # Turn it into a fraction from 0 up, invert it and set the values lower than 0 to 0. Multiply this by 255 to get a value from 0 to 255
+    brightness = np.maximum(1 - (distanceToCenter / (size/2)), 0) * 255
+
+    return brightness.astype(np.uint8)
+
+def returnMapFiles(filename) -> list:
+    """Return the paths of a .tmx file and every tileset and image it uses"""
+    files = [filename]
+    mapDirectory = path.dirname(filename)
+
+    for tileset in ElementTree.parse(filename).getroot().iter("tileset"):
+        tilesetDirectory = mapDirectory
+        images = tileset.findall("image")
+
+        # Tilesets can either be kept in their own .tsx file or inside of the map
+        if tileset.get("source"):
+            tilesetFile = path.join(mapDirectory, tileset.get("source"))
+            files.append(tilesetFile)
+
+            tilesetDirectory = path.dirname(tilesetFile)
+            images = ElementTree.parse(tilesetFile).getroot().iter("image")
+
+        for image in images:
+            files.append(path.join(tilesetDirectory, image.get("source")))
+
+    return files
+
+def returnMapHash(filename, scale) -> str:
+    """Return a hash of the contents of a map, its tilesets and images, and the scale it is drawn at"""
+    mapHash = sha1(str(scale).encode())
+    for file in returnMapFiles(filename):
+        with open(file, "rb") as f:
+            mapHash.update(f.read())
+
+    return mapHash.hexdigest()
+
+# The layers of a map that are drawn into chunks
+MAP_LAYERS = ["background", "top", "wall"]
+
 class TileMap:
     def __init__(self, filename, scale):
+        self.filename = filename
         self.scale = scale
 
-        tm = pytmx.load_pygame(filename, pixelalpha=True)
+        # The tile images are only loaded once a chunk that hasn't been drawn before is needed
+        tm = pytmx.TiledMap(filename)
+        self.tilesLoaded = False
 
         self.width = tm.width * tm.tilewidth * scale
         self.height = tm.height * tm.tileheight * scale
 
         self.tmxdata = tm
 
-        # Generate the background image
-        self.backgroundImg, self.topImg, self.wallMask = self.make_map()
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
 
-        self.topImg.set_colorkey(BLACK)
-        self.wallMask.set_colorkey(BLACK)
+        self.tileWidth = tm.tilewidth * scale
+        self.tileHeight = tm.tileheight * scale
 
-        self.rect = self.backgroundImg.get_rect()
-    
-    def render(self, bg_surface, top_surface, wall_mask_surface):
-        """A function that draws the map onto a surface"""
+        # Each tile is only scaled the first time it is used
+        self.scaledTiles = {}
+
+        # Drawn chunks are kept on the disk, and the recently used ones in memory
+        self.chunkSize = MAP_CHUNK_SIZE
+        self.chunkColumns = int(-(-self.width // self.chunkSize))
+        self.chunkRows = int(-(-self.height // self.chunkSize))
+
+        self.bakedDirectory = path.join(CACHE_DIRECTORY, f"map_{returnMapHash(filename, scale)}")
+        self.chunks = ChunkCache(MAP_CHUNK_BUDGET)
+
+    def getChunk(self, layer, chunkX, chunkY):
+        """Return the surface of one chunk of a layer, drawing it if it isn't cached"""
+        key = (layer, chunkX, chunkY)
+
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.loadBakedChunk(key)
+            if chunk is None:
+                self.renderChunks(chunkX, chunkY)
+                chunk = self.chunks.get(key)
+            else:
+                self.chunks.add(key, chunk)
+
+        return chunk
+
+    def renderChunks(self, chunkX, chunkY) -> None:
+        """Draw every layer of a chunk, cache them and save them to the disk"""
+        chunkLeft = chunkX * self.chunkSize
+        chunkTop = chunkY * self.chunkSize
+
+        # Make a surface for each layer of the chunk to be drawn onto
+        surfaces = [pygame.Surface((self.chunkSize, self.chunkSize)) for layer in MAP_LAYERS]
+
+        # Only draw the tiles that overlap the chunk
+        left = max(int(chunkLeft // self.tileWidth), 0)
+        top = max(int(chunkTop // self.tileHeight), 0)
+        right = min(int((chunkLeft + self.chunkSize - 1) // self.tileWidth), self.tmxdata.width - 1)
+        bottom = min(int((chunkTop + self.chunkSize - 1) // self.tileHeight), self.tmxdata.height - 1)
+
+        self.drawTiles(surfaces, (left, top, right, bottom), self.tileWidth, self.tileHeight, (chunkLeft, chunkTop))
+
+        for layer, surface in zip(MAP_LAYERS, surfaces):
+            if layer != "background":
+                surface.set_colorkey(BLACK)
+
+            self.chunks.add((layer, chunkX, chunkY), surface)
+            self.saveBakedChunk((layer, chunkX, chunkY), surface)
+
+    def drawTiles(self, surfaces, tileRange, tileWidth, tileHeight, origin) -> None:
+        """Draw the tiles in a range of (left, top, right, bottom) onto a surface for each of MAP_LAYERS, with the map at origin in the top left of them"""
+        if not self.tilesLoaded:
+            self.tmxdata = pytmx.load_pygame(self.filename, pixelalpha=True)
+            self.tilesLoaded = True
 
         tile_image = self.tmxdata.get_tile_image_by_gid
         tile_prop = self.tmxdata.get_tile_properties_by_gid
 
+        bg_surface, top_surface, wall_mask_surface = surfaces
+        left, top, right, bottom = tileRange
+
         # For every visible layer
         for layer in self.tmxdata.visible_layers:
             # If the layer is a tile layer
             if isinstance(layer, pytmx.TiledTileLayer):
-                # For every position on that layer
-                for x, y, gid in layer:
-                    # Get the tile image
-                    tile = tile_image(gid)
-                    
-                    # If there is a tile in that spot
-                    if tile:
-                        # Scale the image and draw it onto the surface
-                        tile = pygame.transform.scale(tile, (int(self.tmxdata.tilewidth * self.scale), int(self.tmxdata.tileheight * self.scale)))
-                        if layer.name == "Above":
-                            top_surface.blit(tile, (x * self.tmxdata.tilewidth * self.scale, y * self.tmxdata.tileheight * self.scale))
-                        else:
-                            bg_surface.blit(tile, (x * self.tmxdata.tilewidth * self.scale, y * self.tmxdata.tileheight * self.scale))
-
-
-                        if tile_prop(gid)["isWall"]:
-                            pygame.draw.rect(wall_mask_surface, WHITE, (x * self.tmxdata.tilewidth * self.scale, y * self.tmxdata.tileheight * self.scale, int(self.tmxdata.tilewidth * self.scale), int(self.tmxdata.tileheight * self.scale)), 0)
-
-
-        return bg_surface, top_surface, wall_mask_surface
-
-    def make_map(self):
-        # Make a surface for the map to be drawn onto
-        temp_bg_surface = pygame.Surface((self.width, self.height))
-        temp_top_surface = pygame.Surface((self.width, self.height))
-        temp_wall_surface = pygame.Surface((self.width, self.height))
-
-        # Draw the map onto the surface and return it
-        return self.render(temp_bg_surface, temp_top_surface, temp_wall_surface)
+                # For every position on that layer inside of the range
+                for y in range(top, bottom + 1):
+                    for x in range(left, right + 1):
+                        gid = layer.data[y][x]
+
+                        # Each tile fills the gap up to the next one so there are no seams when the tiles aren't a whole number of pixels
+                        position = (int(x * tileWidth) - origin[0], int(y * tileHeight) - origin[1])
+                        tileSize = (int((x + 1) * tileWidth) - origin[0] - position[0], int((y + 1) * tileHeight) - origin[1] - position[1])
+
+                        # Get the scaled tile image
+                        if (gid, tileSize) not in self.scaledTiles:
+                            tile = tile_image(gid)
+                            self.scaledTiles[(gid, tileSize)] = pygame.transform.scale(tile, tileSize) if tile else None
+                        tile = self.scaledTiles[(gid, tileSize)]
+
+                        # If there is a tile in that spot
+                        if tile:
+                            # Draw it onto the surface
+                            if layer.name == "Above":
+                                top_surface.blit(tile, position)
+                            else:
+                                bg_surface.blit(tile, position)
+
+                            if tile_prop(gid)["isWall"]:
+                                pygame.draw.rect(wall_mask_surface, WHITE, (position, tileSize), 0)
+
+    def returnChunkPath(self, key) -> str:
+        layer, chunkX, chunkY = key
+        return path.join(self.bakedDirectory, f"{layer}_{chunkX}_{chunkY}.raw")
+
+    def saveBakedChunk(self, key, surface) -> None:
+        """Save a drawn chunk to the disk as raw RGB"""
+        self.saveBakedSurface(self.returnChunkPath(key), surface)
+
+    def saveBakedSurface(self, surfacePath, surface) -> None:
+        makedirs(self.bakedDirectory, exist_ok=True)
+
+        # Write to a temporary file first so other processes never read half a surface
+        with open(surfacePath + ".tmp", "wb") as f:
+            f.write(pygame.image.tobytes(surface, "RGB"))
+        os.replace(surfacePath + ".tmp", surfacePath)
+
+    def loadBakedChunk(self, key):
+        """Load a chunk saved by saveBakedChunk, or return None if it can't be read"""
+        chunk = self.loadBakedSurface(self.returnChunkPath(key), (self.chunkSize, self.chunkSize))
+        if chunk and key[0] != "background":
+            chunk.set_colorkey(BLACK)
+
+        return chunk
+
+    def loadBakedSurface(self, surfacePath, size):
+        """Load a surface saved by saveBakedSurface, or return None if it can't be read"""
+        try:
+            with open(surfacePath, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(data) != size[0] * size[1] * 3:
+            return None
+
+        return pygame.image.frombytes(data, size, "RGB")
+
+    def drawLayer(self, surface, layer, cameraPos) -> None:
+        """Draw the chunks of a layer that are visible to a camera onto a surface"""
+        # Round the camera the same way blitting the whole map at -cameraPos would
+        cameraPos = (int(cameraPos[0]), int(cameraPos[1]))
+
+        left = max(int(cameraPos[0] // self.chunkSize), 0)
+        top = max(int(cameraPos[1] // self.chunkSize), 0)
+        right = min(int((cameraPos[0] + surface.get_width() - 1) // self.chunkSize), self.chunkColumns - 1)
+        bottom = min(int((cameraPos[1] + surface.get_height() - 1) // self.chunkSize), self.chunkRows - 1)
+
+        for chunkY in range(top, bottom + 1):
+            for chunkX in range(left, right + 1):
+                surface.blit(self.getChunk(layer, chunkX, chunkY), (chunkX * self.chunkSize - cameraPos[0], chunkY * self.chunkSize - cameraPos[1]))
+
+    def returnScaledLayer(self, layer, scale):
+        """Return a whole layer scaled down, drawn straight from the tiles at that size so no chunk has to be drawn or loaded"""
+        size = (int(self.width * scale), int(self.height * scale))
+
+        # Scaled layers are baked alongside the chunks
+        scaledPath = path.join(self.bakedDirectory, f"{layer}_scaled_{scale}.raw")
+        scaled = self.loadBakedSurface(scaledPath, size)
+
+        if scaled is None:
+            surfaces = [pygame.Surface(size) for mapLayer in MAP_LAYERS]
+            self.drawTiles(surfaces, (0, 0, self.tmxdata.width - 1, self.tmxdata.height - 1), self.tileWidth * scale, self.tileHeight * scale, (0, 0))
+
+            scaled = surfaces[MAP_LAYERS.index(layer)]
+            self.saveBakedSurface(scaledPath, scaled)
+
+        if layer != "background":
+            scaled.set_colorkey(BLACK)
+
+        return scaled
+
+class ChunkCache:
+    """A least recently used cache of map chunks that is kept within a memory budget"""
+    def __init__(self, memoryBudget):
+        self.memoryBudget = memoryBudget
+
+        self.surfaces = OrderedDict()
+        self.memoryUsed = 0
+
+    def get(self, key):
+        chunk = self.surfaces.get(key)
+        if chunk is not None:
+            self.surfaces.move_to_end(key)
+
+        return chunk
+
+    def add(self, key, chunk) -> None:
+        if key in self.surfaces:
+            self.memoryUsed -= self.surfaces[key].get_pitch() * self.surfaces[key].get_height()
+
+        self.surfaces[key] = chunk
+        self.surfaces.move_to_end(key)
+        self.memoryUsed += chunk.get_pitch() * chunk.get_height()
+
+        # Evict the least recently used chunks until the cache fits in its budget
+        while self.memoryUsed > self.memoryBudget and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.memoryUsed -= evicted.get_pitch() * evicted.get_height()
+
+class RotationCache:
+    """Images pre-rotated to a fixed number of angles, either all up front or on first use within a memory budget"""
+    def __init__(self, images, steps, memoryBudget, eager=False, atlas=False):
+        self.images = images
+        self.steps = steps
+        self.memoryBudget = memoryBudget
+
+        self.frames = OrderedDict()
+        self.memoryUsed = 0
+
+        # Frames made up front are never evicted
+        self.eager = eager or atlas
+        self.atlas = None
+
+        if self.eager:
+            for name in images:
+                for step in range(steps):
+                    self.frames[(name, step)] = self.rotateImage(name, step)
+
+            if atlas:
+                self.packAtlas()
+
+    def returnStep(self, angle) -> int:
+        """Return the index of the nearest quantized angle"""
+        return round(angle * self.steps / 360) % self.steps
+
+    def rotateImage(self, name, step):
+        return pygame.transform.rotate(self.images[name], step * 360 / self.steps)
+
+    def get(self, name, angle):
+        """Return an image rotated to the nearest quantized angle"""
+        key = (name, self.returnStep(angle))
+
+        frame = self.frames.get(key)
+        if frame is None:
+            frame = self.rotateImage(*key)
+            self.frames[key] = frame
+            self.memoryUsed += frame.get_pitch() * frame.get_height()
+
+            # Evict the least recently used frames until the cache fits in its budget
+            while self.memoryUsed > self.memoryBudget and len(self.frames) > 1:
+                _, evicted = self.frames.popitem(last=False)
+                self.memoryUsed -= evicted.get_pitch() * evicted.get_height()
+        elif not self.eager:
+            self.frames.move_to_end(key)
+
+        return frame
+
+    def packAtlas(self) -> None:
+        """Pack every frame into one surface, replacing the frames with subsurfaces of it"""
+        atlasSize, positions = packShelves({key: frame.get_size() for key, frame in self.frames.items()})
+
+        self.atlas = pygame.Surface(atlasSize, pygame.SRCALPHA)
+        for key, position in positions.items():
+            frame = self.frames[key]
+            self.atlas.blit(frame, position)
+            self.frames[key] = self.atlas.subsurface(pygame.Rect(position, frame.get_size()))
+
+def packShelves(sizes) -> tuple:
+    """Pack rects of the given sizes into rows, returning the size of the whole and the position of each"""
+    # Aim for a roughly square atlas
+    area = sum(width * height for width, height in sizes.values())
+    atlasWidth = max(int(sqrt(area) * 1.1), max(width for width, _ in sizes.values()))
+
+    # Place the rects in rows from tallest to shortest
+    keys = sorted(sizes, key=lambda key: sizes[key][1], reverse=True)
+
+    positions = {}
+    x = y = rowHeight = 0
+    for key in keys:
+        width, height = sizes[key]
+        if x + width > atlasWidth:
+            x = 0
+            y += rowHeight
+            rowHeight = 0
+
+        positions[key] = (x, y)
+        x += width
+        rowHeight = max(rowHeight, height)
+
+    return (atlasWidth, y + rowHeight), positions
 
 class Camera:
     def __init__(self, width, height):